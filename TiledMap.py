@@ -1,54 +1,422 @@
+import math
+import os
+import warnings
+from bisect import bisect_right
+from collections import OrderedDict
+import numpy as np
 import pygame as pg
-import pytmx
-from pytmx.util_pygame import load_pygame
+import map_compiler
+from spatial_hash import SpatialHash
+from tileset_cache import tileset_cache
 
 # TiledMap class to properly render Tiled maps by layer to surfaces.
+# Maps are loaded from their compiled form (see map_compiler) so no XML is parsed at runtime.
+# Small maps are rendered once into full map surfaces with make_map.
+# Maps larger than the screen are split into fixed size chunks that are rendered lazily
+# when they first come into view and kept in a least recently used cache.
+# Given a FrameCache, make_map reads the rendered surfaces from it instead of blitting every tile again.
+# Layers are drawn with one Surface.blits call each. With assemble, the topmost layer that is fully opaque over the
+# rendered area is instead built in one go from the tile pixels with NumPy and the layers it hides are skipped.
+# Bottom layers with a parallax factor scroll at their own speed. Each is rendered once into a strip that wraps
+# horizontally and is drawn behind the back surface, which is then transparent where they show through.
+# This is only the engine side: no shipped map sets a parallax factor, as their sky layers end in a ragged edge that
+# only the platforms in front cover and scrolling them would show black through the gaps.
 class TiledMap:
-    def __init__(self, filename):
-        tm = load_pygame(filename)
-        self.width = tm.width * tm.tilewidth
-        self.height = tm.height * tm.tileheight
-        self.tm = tm
-        self.blockers = []
-        self.battle_spawns = []
+
+    # Chunk edge length in pixels.
+    CHUNK_SIZE = 256
+
+    def __init__(self, filename, viewport=(1920, 1080), cache=None, assemble=True, convert=True):
+
+        """ Loads the compiled map and reads its tileset images.
+            Unless convert is False, the tiles are also cut from the tileset images with load_tiles.
+            Maps built on a worker thread pass False and call load_tiles on the main thread,
+            as converting surfaces needs the display. """
+
+        compiled = map_compiler.load(filename)
+        self.filename = filename
+        self.cache = cache
+        self.assemble = assemble
+        self.tilewidth = compiled.tilewidth
+        self.tileheight = compiled.tileheight
+        # Size in tiles.
+        self.columns = compiled.width
+        self.rows = compiled.height
+        self.width = compiled.width * compiled.tilewidth
+        self.height = compiled.height * compiled.tileheight
+        self.compiled = compiled
+        # First GID of every tileset, in order.
+        self.firstgids = [tileset['firstgid'] for tileset in compiled.tilesets]
+        # GIDs of every tile the map uses.
+        grids = [grid.ravel() for name, front, parallax, grid in compiled.layers]
+        self.used = [gid for gid in (np.unique(np.concatenate(grids)).tolist() if grids else []) if gid != 0]
+        # Visible tile layers in drawing order. Parallax layers as (name, factor, grid) and the rest as
+        # (name, front, grid). Only layers below all others can scroll, any other parallax layer is drawn with the map.
+        layers = list(compiled.layers)
+        self.parallax_layers = []
+        while layers and layers[0][2] != 1 and not layers[0][1]:
+            name, front, parallax, grid = layers.pop(0)
+            self.parallax_layers.append((name, parallax, grid))
+        for name, front, parallax, grid in layers:
+            if parallax != 1:
+                warnings.warn('Layer %s of %s has a parallax factor but is not below all other layers, '
+                              'it will scroll with the map' % (name, filename))
+        self.layers = [(name, front, grid) for name, front, parallax, grid in layers]
+        self.strips = None
+        # Tileset images read and decoded for the map by image path, until load_tiles converts them.
+        self.read_images = self.read_tilesets()
+        self.tileset_images = []
+        self.tiles = {}
+        if convert:
+            self.load_tiles()
+        # Pixels of the fully opaque tiles and the index of each GID in them. Made when first assembling a layer.
+        self.opaque_lookup = None
+        self.opaque_pixels = None
+
+        # Create a list of platforms and walls by rect, and of spawn locations by rect for battle maps.
+        self.blockers = [pg.Rect(rect) for rect in compiled.blockers]
+        self.battle_spawns = [pg.Rect(rect) for rect in compiled.spawns]
+        # Spatial index of the blockers. Collision checks query it instead of scanning every blocker.
+        self.blocker_index = SpatialHash(self.blockers)
+
+        # Chunk cache. Holds enough chunks to cover the viewport plus a ring around it.
+        self.chunks = OrderedDict()
+        self.max_chunks = (math.ceil(viewport[0] / self.CHUNK_SIZE) + 2) * (math.ceil(viewport[1] / self.CHUNK_SIZE) + 2)
+        self.back_surface = None
+        self.front_surface = None
+
+    def tileset(self, gid):
+        # Tileset the tile gid belongs to. A flipped tile belongs to the tileset of the tile it flips.
+        gid = self.compiled.flipped.get(gid, (gid, 0))[0]
+        return self.compiled.tilesets[bisect_right(self.firstgids, gid) - 1]
+
+    def read_tilesets(self):
+        # Reads the tileset images the map uses. Nothing is converted, so this can run on a worker thread.
+        directory = os.path.dirname(self.filename)
+        read_images = {}
+        for gid in self.used:
+            tileset = self.tileset(gid)
+            if tileset['image'] not in read_images:
+                read_images[tileset['image']] = tileset_cache.read(os.path.join(directory, tileset['image']),
+                                                                   tileset['trans'])
+        return read_images
+
+    def load_tiles(self):
+        # Cuts the image of every tile used by the map from its tileset image into self.tiles, a dict of GID to image.
+        # Tileset images are shared with every other map using the same sheet. Must be called on the main thread.
+        # Flipped tiles are transformed copies of their tile, flipped the way Tiled applies the flags: diagonally
+        # first, which swaps x and y, then horizontally, then vertically.
+        if self.read_images is None:
+            return
+        directory = os.path.dirname(self.filename)
+        images = {}
+        for gid in self.used:
+            tileset = self.tileset(gid)
+            image = images.get(tileset['image'])
+            if image is None:
+                image = tileset_cache.image(os.path.join(directory, tileset['image']), tileset['trans'],
+                                            self.read_images[tileset['image']])
+                images[tileset['image']] = image
+                self.tileset_images.append(image)
+            base, flags = self.compiled.flipped.get(gid, (gid, 0))
+            index = base - tileset['firstgid']
+            tw, th = tileset['tilewidth'], tileset['tileheight']
+            x = tileset['margin'] + (index % tileset['columns']) * (tw + tileset['spacing'])
+            y = tileset['margin'] + (index // tileset['columns']) * (th + tileset['spacing'])
+            tile = image.subsurface((x, y, tw, th))
+            if flags & map_compiler.FLIPPED_DIAGONALLY:
+                tile = pg.transform.flip(pg.transform.rotate(tile, 90), False, True)
+            if flags & (map_compiler.FLIPPED_HORIZONTALLY | map_compiler.FLIPPED_VERTICALLY):
+                tile = pg.transform.flip(tile, bool(flags & map_compiler.FLIPPED_HORIZONTALLY),
+                                         bool(flags & map_compiler.FLIPPED_VERTICALLY))
+            self.tiles[gid] = tile
+        self.read_images = None
+
+    def opaque_tiles(self):
+        # Returns the lookup from GID to index in the opaque tile pixels (-1 for other tiles) and the pixels,
+        # shaped (tile, x, y, rgb) like surfarray arrays. Tiles of another size than the map's are left out.
+        if self.opaque_lookup is None:
+            size = (self.tilewidth, self.tileheight)
+            lookup = np.full(max(self.tiles, default=0) + 1, -1, dtype=np.intp)
+            # Tiles grouped by the tileset image they are cut from, whose pixels are then read once for all of them.
+            # Flipped tiles are copies and make up a group of their own.
+            sheets = {}
+            for gid, tile in self.tiles.items():
+                if tile.get_size() != size or tile.get_colorkey() is not None:
+                    continue
+                sheet = tile.get_parent() or tile
+                sheets.setdefault(id(sheet), (sheet, []))[1].append((gid, tile.get_offset()))
+            pixels = []
+            count = 0
+            for sheet, tiles in sheets.values():
+                gids = np.array([gid for gid, offset in tiles])
+                # Index arrays picking every tile out of the sheet at once, shaped (tile, x, y).
+                xs = np.array([offset[0] for gid, offset in tiles])[:, None, None] + np.arange(size[0])[:, None]
+                ys = np.array([offset[1] for gid, offset in tiles])[:, None, None] + np.arange(size[1])
+                alpha = sheet.get_flags() & pg.SRCALPHA
+                if sheet.get_bytesize() == 4:
+                    # Gathering whole pixels and splitting them into channels is much faster than gathering channels.
+                    packed = pg.surfarray.pixels2d(sheet)[xs, ys]
+                    shifts = sheet.get_shifts()
+                    if alpha:
+                        opaque = (packed >> shifts[3] & 0xff).min(axis=(1, 2)) == 255
+                        gids, packed = gids[opaque], packed[opaque]
+                    rgb = np.empty(packed.shape + (3,), dtype=np.uint8)
+                    for channel in range(3):
+                        rgb[..., channel] = packed >> shifts[channel]
+                else:
+                    rgb = pg.surfarray.pixels3d(sheet)[xs, ys]
+                    if alpha:
+                        opaque = pg.surfarray.pixels_alpha(sheet)[xs, ys].min(axis=(1, 2)) == 255
+                        gids, rgb = gids[opaque], rgb[opaque]
+                lookup[gids] = np.arange(count, count + len(gids))
+                count += len(gids)
+                pixels.append(rgb)
+            # Followed by a black tile standing in for empty tiles.
+            pixels.append(np.zeros((1, size[0], size[1], 3), dtype=np.uint8))
+            self.opaque_lookup = lookup
+            self.opaque_pixels = np.concatenate(pixels)
+        return self.opaque_lookup, self.opaque_pixels
+
+    def assemble_layer(self, grid, empty_black=False):
+        # Returns the tiles of grid, part of a layer, as one opaque surface, or None unless all of them are opaque.
+        # With empty_black, empty tiles are black instead.
+        lookup, pixels = self.opaque_tiles()
+        indices = lookup[grid]
+        if empty_black:
+            indices[grid == 0] = len(pixels) - 1
+        if indices.size == 0 or (indices < 0).any():
+            return None
+        rows, columns = indices.shape
+        # (row, column, x, y, rgb) to (column, x, row, y, rgb), which is the layout of the assembled surface.
+        image = pixels[indices].transpose(1, 2, 0, 3, 4).reshape(columns * self.tilewidth, rows * self.tileheight, 3)
+        return pg.surfarray.make_surface(image)
+
+    def draw_layers(self, surface, layers, area, on_black, assemble=True):
+        # Draws layers, the full grids of layers from bottom to top, onto surface. Only the tiles inside area, a rect
+        # of the map, are drawn, relative to its top left. on_black tells that surface is a new black surface.
+        # assemble=False blits every tile, which picks up tiles changed in self.tiles since the opaque pixels were made.
+        tiles = self.tiles
+        tw = self.tilewidth
+        th = self.tileheight
+        # Tile index range covering the area.
+        x0, x1 = area.left // tw, min(math.ceil(area.right / tw), self.columns)
+        y0, y1 = area.top // th, min(math.ceil(area.bottom / th), self.rows)
+        grids = [grid[y0:y1, x0:x1] for grid in layers]
+        # Layers under a layer that is opaque everywhere in the area are hidden and not drawn.
+        # A bottom layer lying on black is assembled as long as the tiles it has are opaque.
+        first = 0
+        if assemble and self.assemble:
+            for index in range(len(grids) - 1, -1, -1):
+                image = self.assemble_layer(grids[index], empty_black=on_black and index == 0)
+                if image is not None:
+                    surface.blit(image, (x0 * tw - area.x, y0 * th - area.y))
+                    first = index + 1
+                    break
+        for grid in grids[first:]:
+            surface.blits([(tiles[gid], (x * tw - area.x, y * th - area.y))
+                           for y, row in enumerate(grid.tolist(), y0)
+                           for x, gid in enumerate(row, x0) if gid], doreturn=False)
 
     # Renders two surfaces. back_surface is the surface that sprites appear in front of. top_surface vice versa.
-    def render(self, back_surface, top_surface):
-        first_time = True
-        ti = self.tm.get_tile_image_by_gid
-        self.last_layer = 0
-        self.layer_counter = 0
-        # Determine last tile layer.
-        for layer in self.tm.visible_tile_layers:
-            self.last_layer += 1
-        for layer in self.tm.visible_layers:
-            self.layer_counter += 1
-
-            # Create a surface of tiles for back and front surfaces.
-            if isinstance(layer, pytmx.TiledTileLayer):
-                for x, y, gid in layer:
-                    tile = ti(gid)
-                    if tile:
-                        if self.layer_counter != self.last_layer:
-                            back_surface.blit(tile, (x * self.tm.tilewidth, y * self.tm.tileheight))
-                        else:
-                            top_surface.blit(tile, (x * self.tm.tilewidth, y * self.tm.tileheight))
-
-            # Create a list of platforms and walls by rect.
-            elif isinstance(layer, pytmx.TiledObjectGroup) and first_time:
-                for object in layer:
-                    new_rect = pg.Rect(object.x, object.y, object.width, object.height)
-                    self.blockers.append(new_rect)
-                first_time = False
-
-            # Create a list of spawn locations by rect for battle maps.
-            elif isinstance(layer, pytmx.TiledObjectGroup):
-                for object in layer:
-                    new_rect = pg.Rect(object.x, object.y, object.width, object.height)
-                    self.battle_spawns.append(new_rect)
+    # Both are new surfaces made by new_surfaces.
+    # If area is given, only the tiles inside that rect of the map are rendered, relative to its top left.
+    def render(self, back_surface, top_surface, area=None):
+        if area is None:
+            area = pg.Rect((0, 0), (self.width, self.height))
+        for front, surface in ((False, back_surface), (True, top_surface)):
+            layers = [grid for name, layer_front, grid in self.layers if layer_front == front]
+            self.draw_layers(surface, layers, area, not front and not self.parallax_layers)
+
+    def new_surfaces(self, size):
+        # New back and front surfaces. The back is black, or transparent if parallax layers show through it.
+        if self.parallax_layers:
+            back_surface = pg.Surface(size, pg.SRCALPHA, 32).convert_alpha()
+        else:
+            back_surface = pg.Surface(size).convert()
+        return back_surface, pg.Surface(size, pg.SRCALPHA, 32).convert_alpha()
+
+    def render_strip(self, index):
+        # Renders the parallax layer at index into a strip the size of the map. The bottom one lies on black.
+        area = pg.Rect((0, 0), (self.width, self.height))
+        if index:
+            strip = pg.Surface(area.size, pg.SRCALPHA, 32).convert_alpha()
+        else:
+            strip = pg.Surface(area.size).convert()
+        self.draw_layers(strip, [self.parallax_layers[index][2]], area, not index)
+        return strip
+
+    def render_strips(self):
+        return [self.render_strip(index) for index in range(len(self.parallax_layers))]
+
+    def make_strips(self):
+        if self.strips is None:
+            self.strips = self.render_strips()
+        return self.strips
+
+    def refresh_strip(self, name, area=None, camera=None):
+
+        """ Renders area, a rect of the map, of the parallax layer called name again, such as the tiles of an
+            animated sky that changed in self.tiles. The whole layer is rendered again if area is None.
+            Returns the screen rects the area is seen at through camera. Added to the map's refresh_rects, they are
+            merged with the other dirty rects by DirtyRegions and redrawn on the next frame. """
+
+        map_rect = pg.Rect((0, 0), (self.width, self.height))
+        area = map_rect if area is None else map_rect.clip(area)
+        if self.strips is None or not area:
+            return []
+        for index, (layer_name, factor, grid) in enumerate(self.parallax_layers):
+            if layer_name != name:
+                continue
+            strip = self.strips[index]
+            strip.fill((0, 0, 0, 0) if index else (0, 0, 0), area)
+            self.draw_layers(strip.subsurface(area), [grid], area, not index, assemble=False)
+            if camera is None:
+                return []
+            # The strip is seen shifted by camera.rect.x * (1 - factor) and wraps around, see draw_parallax.
+            # Rects are widened by a pixel on each side as the shift is rounded when drawn.
+            view = camera.rect.clip(map_rect)
+            x = math.floor(area.x + camera.rect.x * (1 - factor)) - 1
+            rects = [pg.Rect(x + wrap, area.y, area.width + 2, area.height).clip(view)
+                     for wrap in (-self.width, 0, self.width)]
+            return [camera.apply(rect) for rect in rects if rect]
+        return []
+
+    def draw_parallax(self, screen, camera, area):
+
+        """ Blits the parallax strips seen through area, a rect of the map in view.
+            A strip scrolls factor times as far as the camera and wraps around horizontally,
+            so it takes at most two blits per strip. """
+
+        position = camera.apply(area)
+        for (name, factor, grid), strip in zip(self.parallax_layers, self.make_strips()):
+            width = strip.get_width()
+            x = int(area.x - camera.rect.x * (1 - factor)) % width
+            part = min(area.width, width - x)
+            screen.blit(strip, position, (x, area.y, part, area.height))
+            if part < area.width:
+                screen.blit(strip, (position.x + part, position.y), (0, area.y, area.width - part, area.height))
+
+    def sources(self):
+        # The map file, its tileset files and the tileset images. The cached surfaces are rebuilt when any of them change.
+        directory = os.path.dirname(self.filename)
+        sources = [self.filename]
+        sources.extend(os.path.join(directory, source) for source in self.compiled.tileset_files)
+        sources.extend(os.path.join(directory, tileset['image']) for tileset in self.compiled.tilesets)
+        return list(dict.fromkeys(sources))
+
+    def render_map(self):
+        # Full map back and front surfaces followed by the parallax strips.
+        back_surface, front_surface = self.new_surfaces((self.width, self.height))
+        self.render(back_surface, front_surface)
+        return [back_surface, front_surface] + self.render_strips()
 
     def make_map(self):
-        self.back_surface = pg.Surface((self.width, self.height)).convert()
-        self.front_surface = pg.Surface((self.width, self.height), pg.SRCALPHA, 32).convert_alpha()
-        self.render(self.back_surface, self.front_surface)
+        # Renders the map into full map surfaces. With a cache they are read from the baked frame cache,
+        # which maps the stored pixels instead of blitting every tile, and only rebuilt when a source changes.
+        if self.cache is None:
+            surfaces = self.render_map()
+        else:
+            name = 'map_' + os.path.splitext(os.path.basename(self.filename))[0]
+            sizes = [self.width, self.height, [factor for name, factor, grid in self.parallax_layers]]
+            surfaces = self.cache.load(name, self.sources(), sizes, lambda: [self.render_map()])[0]
+        self.back_surface, self.front_surface = surfaces[:2]
+        self.strips = surfaces[2:]
         return self.back_surface, self.front_surface
+
+    def chunk(self, cx, cy):
+        # Returns the back and front surface of a chunk, rendering it if it is not cached.
+        key = (cx, cy)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+        area = self.chunk_rect(cx, cy)
+        back, front = self.new_surfaces(area.size)
+        self.render(back, front, area)
+        self.chunks[key] = (back, front)
+        # Evict the least recently used chunk.
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return back, front
+
+    def chunk_rect(self, cx, cy):
+        size = self.CHUNK_SIZE
+        return pg.Rect((cx * size, cy * size), (size, size)).clip(pg.Rect((0, 0), (self.width, self.height)))
+
+    def chunks_in(self, area):
+        # Chunk coordinates of every chunk overlapping a rect of the map.
+        size = self.CHUNK_SIZE
+        for cy in range(area.top // size, (area.bottom - 1) // size + 1):
+            for cx in range(area.left // size, (area.right - 1) // size + 1):
+                yield cx, cy
+
+    def prerender(self, area, limit=None):
+        # Render the chunks of an area ahead of time, such as the area in view when the map is entered.
+        # With limit, at most that many chunks are rendered so the work can be spread over several frames.
+        # Returns True once every chunk of the area is rendered.
+        area = area.clip(pg.Rect((0, 0), (self.width, self.height)))
+        for cx, cy in self.chunks_in(area):
+            if (cx, cy) in self.chunks:
+                continue
+            if limit is not None:
+                if limit == 0:
+                    return False
+                limit -= 1
+            self.chunk(cx, cy)
+        self.make_strips()
+        return True
+
+    def draw(self, screen, index, camera, rects=None):
+
+        """ Blits the back (index 0) or front (index 1) layers of the map onto the screen.
+            rects are screen rects to refresh. The whole viewport is drawn if rects is None.
+            Only the parts of the map that overlap the viewport are blitted.
+            The back layers are drawn over the parallax strips. """
+
+        if rects is None:
+            rects = [screen.get_rect()]
+        map_rect = pg.Rect((0, 0), (self.width, self.height))
+        surface = self.back_surface if index == 0 else self.front_surface
+        for rect in rects:
+            area = camera.to_map(rect).clip(map_rect)
+            if not area:
+                continue
+            if index == 0 and self.parallax_layers:
+                self.draw_parallax(screen, camera, area)
+            # Full map surfaces are used when the map was made with make_map.
+            if surface is not None:
+                screen.blit(surface, camera.apply(area), area)
+                continue
+            for cx, cy in self.chunks_in(area):
+                chunk_rect = self.chunk_rect(cx, cy)
+                part = area.clip(chunk_rect)
+                screen.blit(self.chunk(cx, cy)[index], camera.apply(part), part.move(-chunk_rect.x, -chunk_rect.y))
+
+    def memory(self):
+        # Bytes of pixels held by the rendered surfaces, strips, cached chunks and flipped tiles of the map.
+        # Tileset images are left out as other maps may share them, see tileset_images.
+        surfaces = [self.back_surface, self.front_surface] + (self.strips or [])
+        for chunk in self.chunks.values():
+            surfaces.extend(chunk)
+        # Flipped tiles are copies, the others are subsurfaces of the tileset images.
+        surfaces.extend(tile for tile in self.tiles.values() if tile.get_parent() is None)
+        opaque = self.opaque_pixels.nbytes if self.opaque_pixels is not None else 0
+        return opaque + sum(surface.get_pitch() * surface.get_height() for surface in surfaces if surface is not None)
+
+    def unload(self):
+        # Releases every surface of the map. Collision data is kept.
+        self.back_surface = None
+        self.front_surface = None
+        self.strips = None
+        self.chunks.clear()
+        self.tiles = {}
+        self.read_images = None
+        self.tileset_images = []
+        self.opaque_lookup = None
+        self.opaque_pixels = None
+
+    def draw_back(self, screen, camera, rects=None):
+        self.draw(screen, 0, camera, rects)
+
+    def draw_front(self, screen, camera, rects=None):
+        self.draw(screen, 1, camera, rects)
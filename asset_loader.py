@@ -0,0 +1,73 @@
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import pygame as pg
+import pygame.freetype
+
+
+# Worker pool shared by every asset load. SDL releases the GIL while it decodes images and sounds,
+# so independent files are read in parallel.
+_pool = None
+
+
+def worker_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='asset_loader')
+    return _pool
+
+
+def load_images(paths):
+    # Decodes a list of image files in parallel. The surfaces are returned in order and are not yet
+    # converted, as convert() and convert_alpha() must be called on the main thread.
+    return list(worker_pool().map(pg.image.load, paths))
+
+
+# Queues independent image, sound and font loads on the worker pool.
+# Loads are referenced by key and collected into a dictionary with results().
+class AssetLoader:
+    def __init__(self):
+        self.jobs = {}
+
+    def image(self, key, path, alpha=True, size=None):
+        # Image is converted, and scaled to size if given, once collected.
+        self.jobs[key] = (worker_pool().submit(pg.image.load, path), ('image', alpha, size))
+
+    def sound(self, key, path, volume=None, optional=False):
+        # An optional sound whose file is missing is replaced by silence, so the game still runs without it.
+        if optional and not os.path.exists(path):
+            warnings.warn('Sound file %s is missing and will be silent' % path)
+            self.jobs[key] = (None, ('silence', volume))
+            return
+        self.jobs[key] = (worker_pool().submit(pg.mixer.Sound, path), ('sound', volume))
+
+    def font(self, key, path, size):
+        self.jobs[key] = (worker_pool().submit(pg.freetype.Font, path, size=size), ('font',))
+
+    @staticmethod
+    def finish(asset, options):
+        # Work that has to be done on the main thread.
+        if options[0] == 'image':
+            alpha, size = options[1:]
+            asset = asset.convert_alpha() if alpha else asset.convert()
+            if size is not None:
+                asset = pg.transform.scale(asset, size)
+        elif options[0] in ('sound', 'silence'):
+            if asset is None:
+                # A short silent sound in the mixer's format.
+                frequency, size, channels = pg.mixer.get_init()
+                asset = pg.mixer.Sound(buffer=bytes(1024 * abs(size) // 8 * channels))
+            if options[1] is not None:
+                asset.set_volume(options[1])
+        return asset
+
+    def results(self):
+
+        """ Waits for every queued load and returns the finished assets by key.
+            Any error raised by a worker is raised here. """
+
+        assets = {}
+        for key, (future, options) in self.jobs.items():
+            assets[key] = self.finish(future.result() if future is not None else None, options)
+        self.jobs = {}
+        return assets
@@ -1,6 +1,7 @@
 import pygame as pg
 from combat_system import CombatSystem
 from dialog_system import DialogSystem
+from camera import Camera
 
 
 # Contains all parameters and methods that all map classes contain.
@@ -17,6 +18,19 @@ class BaseMap(CombatSystem, DialogSystem):
         self.event = 0
         self.map_first_time = True
 
+        # Map graphics, set by each map. battle_map is the shared arena of the battle underway, if any.
+        self.map = None
+        self.battle_map = None
+        # Music played on entering the map, unless music is already playing. None leaves the music as it is.
+        self.music_path = None
+        # Fursa's position on entering the map from the previous map and from the next map. None keeps her position.
+        self.spawn = None
+        self.return_spawn = None
+        # Pressing W inside this rect leads back to the previous map. None if the map has no way back.
+        self.exit_rect = None
+        # Npc, enemy and particle sprites taken out of the sprite groups while the map is not the current one.
+        self.own_sprites = {}
+
         # Portal parameters.
         self.p_index = 0
         self.portal_start = False
@@ -29,8 +43,74 @@ class BaseMap(CombatSystem, DialogSystem):
         self.portal_aura = package['portal'][2]
         self.portal_aura.set_volume(0.40)
 
+        # Camera following Fursa. Bounds are set to the size of the current map.
+        self.camera = Camera(1920, 1080)
+
         # Refresh rects and sounds to end when map is terminated.
+        # Refresh rects and ui rects are in screen coordinates.
         self.refresh_rects = []
         self.ui = []
+        # Screen rects whose background was refreshed this frame, or None when the whole screen was.
+        # Set by the game loop before update so the battle UI knows what it has to blit again.
+        self.redrawn_rects = None
+        # False on frames that are simulated but not drawn when fast forwarding. Nothing is sent to the display then.
+        self.frame_drawn = True
         self.end_sounds = [self.portal_aura]
 
+    def step(self):
+        # Advances map animations and timers that run at the fixed simulation rate. Called once per simulation step.
+        # update() only reacts to them and draws, so nothing in a map depends on how fast frames are drawn.
+        # Portal frame change and frame index reset.
+        if self.portal_start is True:
+            self.p_index += 1
+            if self.p_index == len(self.portal_images):
+                self.p_index = 0
+        if self.battle:
+            self.battle_step()
+        elif self.cutscene:
+            self.dialog_step()
+
+    def enter(self, sprites):
+        # Called when the map becomes the current map. Brings back its sprites and sounds and redraws the screen.
+        for key, group in self.own_sprites.items():
+            sprites[key].add(group)
+        self.own_sprites = {}
+        if self.music_path is not None and not pg.mixer.music.get_busy():
+            pg.mixer.music.load(self.music_path)
+            pg.mixer.music.play(loops=-1, start=0.0)
+        if self.portal_start:
+            self.portal_aura.play(loops=-1)
+        self.map_first_time = True
+
+    def leave(self, sprites):
+        # Called when another map becomes the current map.
+        # Cancel any and all sounds in the map upon exit. (such as portal noise)
+        for sound in self.end_sounds:
+            sound.stop()
+        for key in ('npc', 'enemy', 'particles'):
+            self.own_sprites[key] = sprites[key].sprites()
+            sprites[key].empty()
+
+    def own_map(self):
+        # The map's own graphics, also during a battle. Battle arenas are shared and not the map's own.
+        return self.world_map if self.map is self.battle_map else self.map
+
+    def memory(self):
+        # Bytes of pixels held by the map graphics.
+        game_map = self.own_map()
+        return game_map.memory() if game_map is not None else 0
+
+    def tileset_images(self):
+        # Tileset images the map graphics are cut from. They are shared with other maps using the same sheets.
+        game_map = self.own_map()
+        return game_map.tileset_images if game_map is not None else []
+
+    def unload(self):
+        # Releases the surfaces, sounds and sprites of a map that was left. The map can not be entered again.
+        for sound in self.end_sounds:
+            sound.stop()
+        self.own_sprites = {}
+        game_map = self.own_map()
+        if game_map is not None:
+            game_map.unload()
+        self.map = self.battle_map = self.world_map = None
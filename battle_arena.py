@@ -0,0 +1,38 @@
+import pygame as pg
+from TiledMap import TiledMap
+
+
+# Battle arenas shared by every map.
+# An arena is parsed and rendered the first time a battle is fought in it, with the combat UI boxes baked into its
+# front surface, and reused by every later battle in any map using the same arena file.
+# The black transition screen shown before a battle is made once and shared in the same way.
+class BattleArenas:
+    def __init__(self):
+        self.arenas = {}
+        self.transition = None
+
+    def arena(self, path, boxes, cache=None):
+
+        """ Returns the TiledMap of the arena in path, building it if it has not been used yet.
+            boxes are (surface, position) pairs blitted onto its front surface when it is built.
+            Baking in the boxes greatly improves fps due to their alpha pixels.
+            cache is the FrameCache the rendered arena is stored in. """
+
+        arena = self.arenas.get(path)
+        if arena is None:
+            arena = TiledMap(path, cache=cache)
+            arena.make_map()
+            for surface, position in boxes:
+                arena.front_surface.blit(surface, position)
+            self.arenas[path] = arena
+        return arena
+
+    def transition_screen(self, size):
+        # Black screen shown between the impact frame and the battle.
+        if self.transition is None or self.transition.get_size() != size:
+            self.transition = pg.Surface(size).convert()
+            self.transition.fill((0, 0, 0))
+        return self.transition
+
+
+battle_arenas = BattleArenas()
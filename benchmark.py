@@ -0,0 +1,409 @@
+""" Headless benchmark runner.
+    Every scenario is run in its own process with SDL's dummy video and audio drivers and scripted input.
+    Each scenario is run once to warm up and then --runs times. The median of every metric over the runs is
+    written to JSON along with the worst run, and compared to the baseline in benchmark_baseline.json.
+    The baseline is measured on the machine it is compared on and is not kept in the repository.
+    Exits with 1 on a regression and 2 if there is no baseline to compare to.
+
+        python benchmark.py --save-baseline         Run every scenario and store the results as the baseline.
+        python benchmark.py                         Run every scenario and compare to the baseline.
+        python benchmark.py battle portal           Run some scenarios. """
+
+from time import perf_counter
+# Startup time is measured from here, before pygame and the game modules are imported.
+START = perf_counter()
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame as pg
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+# Compiled maps and baked frames. Startup time depends on whether they are there.
+CACHE_DIRECTORY = os.path.join(BASE_DIR, '.cache')
+# Metrics compared to the baseline. Higher is worse for all of them.
+COMPARED = ['p50_ms', 'p90_ms', 'p99_ms', 'startup_ms', 'peak_rss_kb']
+
+
+def percentile(ordered, fraction):
+    # Nearest rank percentile of a sorted list.
+    if not ordered:
+        return 0
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def peak_rss_kb():
+    # Peak resident memory of this process. Not available on Windows.
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+# A scripted run of the game.
+# Frames are only measured while ready() is true, so loading and transitions are left out.
+# Scenarios end after frames measured frames, once finished() is true, or after max_frames frames in total.
+class Scenario:
+    frames = 1000
+    max_frames = 10000
+
+    def __init__(self, options):
+        self.options = options
+        self.frames = options.frames or self.frames
+
+    def setup(self, current_map, sprites):
+        # Called on the first frame.
+        pass
+
+    def script(self, frame, current_map, sprites, keys):
+        # Called every frame to queue input on keys, a ScriptedInput.
+        pass
+
+    def ready(self, current_map, sprites):
+        return True
+
+    def finished(self, current_map, sprites):
+        return False
+
+
+# Map01 opening: first dialogue, walk to Masir, dialogue and portal creation until Masir enters the portal.
+class Map01Intro(Scenario):
+    frames = 5000
+
+    def script(self, frame, current_map, sprites, keys):
+        if current_map.cutscene:
+            keys.hold([])
+            if frame % 40 == 0:
+                keys.click()
+        elif not current_map.Masir_dead:
+            keys.hold([pg.K_d])
+        else:
+            keys.hold([])
+
+    def finished(self, current_map, sprites):
+        return current_map.Masir_dead
+
+
+# Map01 with the portal open and Fursa standing still.
+class PortalAnimation(Scenario):
+    frames = 600
+
+    def setup(self, current_map, sprites):
+        current_map.Masir.kill()
+        current_map.Masir_dead = True
+        current_map.first_cutscene = False
+        current_map.portal_start = True
+
+
+# Helper for scenarios played on Map02. Moves to Map02 on the first frame and skips its opening dialogue.
+class Map02Scenario(Scenario):
+    def __init__(self, options):
+        super().__init__(options)
+        self.map = None
+
+    def setup(self, current_map, sprites):
+        sprites['character'].sprite.map_forward = True
+
+    def script(self, frame, current_map, sprites, keys):
+        if current_map.__class__.__name__ != 'Map02':
+            return
+        if self.map is not current_map:
+            self.map = current_map
+            current_map.first_cutscene = False
+            self.enter(current_map, sprites)
+        self.play(frame, current_map, sprites, keys)
+
+    def enter(self, current_map, sprites):
+        pass
+
+    def play(self, frame, current_map, sprites, keys):
+        pass
+
+
+# Map02 with skeletons pacing on screen while Fursa walks back and forth out of their aggro range.
+class Map02World(Map02Scenario):
+    frames = 1500
+
+    def enter(self, current_map, sprites):
+        from enemies import Skeleton
+        skeleton = sprites['enemy'].sprites()[0]
+        skeleton.kill()
+        count = self.options.skeletons
+        for i in range(count):
+            sprites['enemy'].add(Skeleton(current_map.enemy_frames, 700 + i * 1100 // count, 500, current_map.fi,
+                                          skeleton.swing_sound))
+        self.direction = pg.K_d
+
+    def play(self, frame, current_map, sprites, keys):
+        fursa = sprites['character'].sprite
+        if fursa.rect.x >= 350:
+            self.direction = pg.K_a
+        elif fursa.rect.x <= 100:
+            self.direction = pg.K_d
+        keys.hold([self.direction])
+
+    def ready(self, current_map, sprites):
+        return self.map is current_map
+
+
+# Full battle: walk up to the skeleton, then alternate attacks and spells.
+class Battle(Map02Scenario):
+    frames = 2000
+    # Attack, then move to the spell slot, open the spells and cast one.
+    commands = [pg.K_r, pg.K_s, pg.K_r, pg.K_r]
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.battle_start = None
+        self.command = 0
+
+    def play(self, frame, current_map, sprites, keys):
+        if not current_map.battle:
+            # Wait for the skeleton to come and attack.
+            fursa = sprites['character'].sprite
+            keys.hold([pg.K_d] if fursa.rect.x < 500 else [])
+            return
+        keys.hold([])
+        # HP and MP are kept full so the battle goes on for the whole run.
+        if current_map.engine is not None:
+            for combatant in current_map.engine.combatants:
+                combatant.hp, combatant.mp = combatant.max_hp, combatant.max_mp
+        # Commands are given once everyone has landed on the battle platform, while Fursa's move is being chosen.
+        if self.battle_start is None:
+            self.battle_start = frame
+        if frame - self.battle_start >= 120 and frame % 30 == 0 and current_map.animation_complete and \
+                current_map.battle_command == 0:
+            keys.tap(self.commands[self.command % len(self.commands)])
+            self.command += 1
+
+    def ready(self, current_map, sprites):
+        return self.map is current_map and current_map.battle and not current_map.battle_init
+
+
+# Map01 with a spirit blast fired every few frames in alternating directions.
+class ProjectileSpam(Scenario):
+    frames = 1500
+    interval = 4
+
+    def setup(self, current_map, sprites):
+        current_map.Masir.kill()
+        current_map.Masir_dead = True
+        current_map.first_cutscene = False
+
+    def script(self, frame, current_map, sprites, keys):
+        from fursa_projectiles import SpiritBlast
+        if frame % self.interval == 0:
+            fursa = sprites['character'].sprite
+            fursa.facing_right = frame // self.interval % 2 == 0
+            sprites['particles'].add(SpiritBlast(fursa))
+
+
+SCENARIOS = {'map01_intro': Map01Intro,
+             'portal': PortalAnimation,
+             'map02_world': Map02World,
+             'battle': Battle,
+             'projectiles': ProjectileSpam}
+
+
+# Drives the game for a scenario and times every measured frame.
+class BenchmarkDriver:
+    def __init__(self, scenario, keys, frame_ms):
+        self.scenario = scenario
+        self.keys = keys
+        self.frame_ms = frame_ms
+        self.frame_count = 0
+        self.first_frame = None
+        self.last = None
+        self.measuring = False
+        self.times = []
+
+    def frame(self, current_map, sprites):
+        now = perf_counter()
+        if self.first_frame is None:
+            self.first_frame = now
+            self.scenario.setup(current_map, sprites)
+        # A frame is measured if the scenario was ready when it started.
+        if self.measuring:
+            self.times.append((now - self.last) * 1000)
+        self.last = now
+        if len(self.times) >= self.scenario.frames or self.frame_count >= self.scenario.max_frames or \
+                self.scenario.finished(current_map, sprites):
+            return False
+
+        # Measured time includes the script, which is negligible next to a frame.
+        self.scenario.script(self.frame_count, current_map, sprites, self.keys)
+        self.measuring = self.scenario.ready(current_map, sprites)
+        self.frame_count += 1
+        return True
+
+
+def run_scenario(name, options):
+    # Runs a single scenario in this process and returns its results.
+    from game_input import game_input, ScriptedInput
+    import kismet
+
+    keys = ScriptedInput()
+    game_input.use(keys)
+    scenario = SCENARIOS[name](options)
+    driver = BenchmarkDriver(scenario, keys, options.frame_ms)
+    kismet.main(driver)
+
+    ordered = sorted(driver.times)
+    return {'frames': len(ordered),
+            'total_frames': driver.frame_count,
+            'mean_ms': sum(ordered) / len(ordered) if ordered else 0,
+            'p50_ms': percentile(ordered, 0.5),
+            'p90_ms': percentile(ordered, 0.9),
+            'p99_ms': percentile(ordered, 0.99),
+            'max_ms': ordered[-1] if ordered else 0,
+            'startup_ms': (driver.first_frame - START) * 1000,
+            'peak_rss_kb': peak_rss_kb()}
+
+
+def run_child(name, options):
+    # Runs a scenario in a fresh process so startup time and peak memory are its own.
+    # With a cold cache the compiled maps and baked frames are removed first, so startup includes making them.
+    if options.cache == 'cold':
+        shutil.rmtree(CACHE_DIRECTORY, ignore_errors=True)
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    command = [sys.executable, os.path.realpath(__file__), name, '--child', '--frame-ms', str(options.frame_ms),
+               '--skeletons', str(options.skeletons)]
+    if options.frames:
+        command += ['--frames', str(options.frames)]
+    result = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError('Scenario %s failed:\n%s' % (name, result.stderr))
+    # The results are the last line printed. The game may print before it.
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def run_scenario_runs(name, options):
+
+    """ Runs a scenario once to warm up and then options.runs times.
+        Returns the median of every metric over the runs, with the worst run of each compared metric in worst. """
+
+    run_child(name, options)
+    runs = [run_child(name, options) for run in range(options.runs)]
+    metrics = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        metrics[metric] = median(values) if values else None
+    metrics['worst'] = {metric: max(run[metric] for run in runs) for metric in COMPARED
+                        if metrics[metric] is not None}
+    return metrics
+
+
+def compare(results, baseline, tolerance, compared=COMPARED):
+
+    """ Returns a line for every metric whose median is worse than the baseline median by more than tolerance,
+        as a fraction of the baseline value, and also worse than the worst baseline run.
+        The worst run bounds the noise between runs, so a metric that varies a lot needs a larger change to fail. """
+
+    regressions = []
+    for name, metrics in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for metric in compared:
+            new, old = metrics.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            if new > old * (1 + tolerance) and new > base.get('worst', {}).get(metric, old):
+                regressions.append('%s %s: %.1f -> %.1f (+%.0f%%)' % (name, metric, old, new, (new / old - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark of scripted game scenarios.')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (%s). All by default.' % ', '.join(SCENARIOS))
+    parser.add_argument('--frames', type=int, help='measured frames per scenario')
+    parser.add_argument('--skeletons', type=int, default=8, help='skeletons in map02_world')
+    parser.add_argument('--frame-ms', type=float, default=1000 / 97, help='game time simulated per frame')
+    parser.add_argument('--output', default=os.path.join(BASE_DIR, 'benchmark_results.json'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--runs', type=int, default=5, help='measured runs per scenario, after a warm up run')
+    parser.add_argument('--cache', choices=['warm', 'cold'], default='warm',
+                        help='start every run with the map and frame caches filled by the warm up run, or empty')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a regression')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    names = options.scenarios or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %s' % name)
+
+    if options.child:
+        print(json.dumps(run_scenario(names[0], options)))
+        return 0
+
+    if options.runs < 1:
+        parser.error('--runs must be at least 1')
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'frame_ms': options.frame_ms,
+               'runs': options.runs,
+               'cache': options.cache,
+               'scenarios': {}}
+    for name in names:
+        metrics = run_scenario_runs(name, options)
+        results['scenarios'][name] = metrics
+        print('%-12s frames %5d  mean %6.2f  p50 %6.2f  p90 %6.2f  p99 %6.2f  max %7.2f ms  '
+              'startup %6.0f ms  rss %s kB' % (name, metrics['frames'], metrics['mean_ms'], metrics['p50_ms'],
+                                                metrics['p90_ms'], metrics['p99_ms'], metrics['max_ms'],
+                                                metrics['startup_ms'], metrics['peak_rss_kb']))
+
+    with open(options.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if options.save_baseline:
+        with open(options.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print('Baseline saved to %s' % options.baseline)
+        return 0
+
+    # Without a baseline nothing can be compared, which fails the run so that a missing baseline is never mistaken
+    # for a passing one.
+    if not os.path.exists(options.baseline):
+        print('No baseline at %s, store one with --save-baseline' % options.baseline, file=sys.stderr)
+        return 2
+    with open(options.baseline) as file:
+        baseline = json.load(file)
+    for name in names:
+        if name not in baseline.get('scenarios', {}):
+            print('Scenario %s is not in the baseline and was not compared' % name, file=sys.stderr)
+    compared = COMPARED
+    if baseline.get('cache') != options.cache:
+        # Startup times with and without the caches filled are not comparable.
+        print('The baseline was measured with a %s cache, startup time was not compared' % baseline.get('cache'),
+              file=sys.stderr)
+        compared = [metric for metric in COMPARED if metric != 'startup_ms']
+    regressions = compare(results, baseline, options.tolerance, compared)
+    for line in regressions:
+        print('REGRESSION %s' % line)
+    if regressions:
+        return 1
+    print('No regressions against %s' % options.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
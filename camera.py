@@ -0,0 +1,71 @@
+import pygame as pg
+from timestep import interpolate
+
+
+# Scrolling camera. Follows a target around maps larger than the screen.
+# Sprites, blockers and map objects are kept in map coordinates. The camera converts them
+# to screen coordinates whenever something is drawn.
+class Camera:
+    def __init__(self, width, height):
+        # Viewport in map coordinates.
+        self.rect = pg.Rect((0, 0), (width, height))
+        self.bounds = pg.Rect((0, 0), (width, height))
+        # Set whenever the viewport changed position. What is on screen has to be scrolled or redrawn when it has.
+        self.moved = True
+        # Distance the viewport moved in the last follow, or None if it jumped to another map.
+        self.delta = None
+        self.jumped = True
+
+    def set_bounds(self, width, height):
+        # Called whenever the map the camera looks at changes.
+        self.bounds = pg.Rect((0, 0), (width, height))
+        self.rect.topleft = (0, 0)
+        self.moved = True
+        self.jumped = True
+
+    def follow(self, target):
+        # Center the viewport on the target rect without showing anything outside of the map.
+        x = min(max(target.centerx - self.rect.width // 2, 0), max(self.bounds.width - self.rect.width, 0))
+        y = min(max(target.centery - self.rect.height // 2, 0), max(self.bounds.height - self.rect.height, 0))
+        self.delta = None if self.jumped else (x - self.rect.x, y - self.rect.y)
+        self.moved = self.jumped or (x, y) != self.rect.topleft
+        self.jumped = False
+        self.rect.topleft = (x, y)
+
+    def scroll(self, screen, rects):
+
+        """ Scrolls the last frame on screen along with the viewport, so only what it uncovered has to be drawn.
+            rects are the screen rects that changed in the last frame. Returns the screen rects to redraw:
+            the uncovered edges of the screen and rects both where they were and where they were scrolled to.
+            Only valid when the last follow moved the viewport by less than the screen size. """
+
+        dx, dy = self.delta
+        screen.scroll(-dx, -dy)
+        width, height = screen.get_size()
+        uncovered = []
+        if dx:
+            uncovered.append(pg.Rect((width - dx if dx > 0 else 0, 0), (abs(dx), height)))
+        if dy:
+            uncovered.append(pg.Rect((0, height - dy if dy > 0 else 0), (width, abs(dy))))
+        return uncovered + list(rects) + [rect.move(-dx, -dy) for rect in rects]
+
+    def can_scroll(self, screen):
+        # Whether the last frame can be scrolled to the viewport of this one.
+        if self.delta is None:
+            return False
+        width, height = screen.get_size()
+        return abs(self.delta[0]) < width and abs(self.delta[1]) < height
+
+    def apply(self, rect):
+        # Map rect to screen rect.
+        return rect.move(-self.rect.x, -self.rect.y)
+
+    def to_map(self, rect):
+        # Screen rect to map rect.
+        return rect.move(self.rect.x, self.rect.y)
+
+    def draw(self, screen, group, alpha=1):
+        # Replacement for pg.sprite.Group.draw that places every sprite relative to the viewport.
+        # alpha interpolates sprites between their last two simulation steps.
+        screen.blits([(sprite.image, self.apply(interpolate(sprite, alpha))) for sprite in group.sprites()],
+                     doreturn=False)
@@ -0,0 +1,197 @@
+import argparse
+import random
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import numpy as np
+from turn_scheduler import TurnScheduler
+
+
+# A combat move. Damage is rolled between min_damage and max_damage when the move hits.
+class Move:
+    def __init__(self, name, min_damage, max_damage, mp_cost=0):
+        self.name = name
+        self.min_damage = min_damage
+        self.max_damage = max_damage
+        self.mp_cost = mp_cost
+
+
+ATTACK = Move('ATTACK', 1, 2)
+SPIRIT_BLAST = Move('SPIRIT BLAST', 2, 3, mp_cost=2)
+SLASH = Move('SLASH', 1, 2)
+
+
+# Battle stats of a party member or an enemy.
+# Sprites keep their stats in a Combatant, which is all the battle engine works with.
+class Combatant:
+    def __init__(self, name, spawn, speed, hp, mp, moves, ally):
+        self.name = name
+        # Battle platform position. See CombatSystem.battle_spawn_pos.
+        self.spawn = spawn
+        self.speed = speed
+        self.hp = self.max_hp = hp
+        self.mp = self.max_mp = mp
+        self.moves = moves
+        self.ally = ally
+
+    @property
+    def alive(self):
+        return self.hp > 0
+
+    def copy(self):
+        # Fresh combatant with the same stats at full hp and mp.
+        return Combatant(self.name, self.spawn, self.speed, self.max_hp, self.max_mp, self.moves, self.ally)
+
+
+# Combat rules of a single battle, without any rendering or timing.
+# Turns are handed out by a TurnScheduler, in rounds from the fastest combatant to the slowest or in ATB mode.
+# On its turn a combatant picks a move with command(), the damage is dealt by hit() on the frame the move
+# connects, and end_turn() passes the turn on.
+# The game calls these from its animations while simulations call them back to back.
+class BattleEngine:
+    def __init__(self, combatants, seed=None, atb=False):
+        self.combatants = list(combatants)
+        # Combatants that have fallen are taken out of the turns.
+        self.scheduler = TurnScheduler([combatant for combatant in self.combatants if combatant.alive], atb)
+        self.scheduler.next()
+        self.turns = 0
+        # (actor, move, target) of the move underway and whether it has hit yet.
+        self.action = None
+        self.landed = False
+        # Damage rolls. Battles with the same seed roll the same damage, a seed of None rolls differently every time.
+        self.random = random.Random(seed)
+        # Combatants standing on each side, keyed by Combatant.ally. Only hits dealt by the engine are counted.
+        self.standing = {True: [], False: []}
+        for combatant in self.combatants:
+            if combatant.alive:
+                self.standing[combatant.ally].append(combatant)
+
+    @property
+    def current(self):
+        # Combatant whose turn it is.
+        return self.scheduler.current
+
+    def opponents(self, combatant):
+        # Opponents of combatant that are still standing. Not to be changed.
+        return self.standing[not combatant.ally]
+
+    @property
+    def finished(self):
+        return not self.standing[True] or not self.standing[False]
+
+    @property
+    def allies_won(self):
+        # True or False once the battle is finished, None before.
+        if not self.finished:
+            return None
+        return bool(self.standing[True])
+
+    def command(self, move, target=None):
+        # Starts move by the current combatant on target, the first opponent standing by default.
+        # Returns False if no one has the turn, a move is already underway, the battle is over or there is not enough mp.
+        actor = self.current
+        if actor is None or self.action is not None or self.finished or move.mp_cost > actor.mp:
+            return False
+        if target is None:
+            target = self.opponents(actor)[0]
+        actor.mp -= move.mp_cost
+        self.action = (actor, move, target)
+        self.landed = False
+        return True
+
+    def hit(self):
+        # Deals the damage of the move underway and returns it.
+        # Animations call this on every step of their hit frame, so only the first call does anything.
+        if self.action is None or self.landed:
+            return 0
+        actor, move, target = self.action
+        damage = min(self.random.randint(move.min_damage, move.max_damage), target.hp)
+        target.hp -= damage
+        if not target.alive:
+            self.standing[target.ally].remove(target)
+            self.scheduler.remove(target)
+        self.landed = True
+        return damage
+
+    def end_turn(self):
+        # Passes the turn to the next combatant still standing.
+        self.action = None
+        self.landed = False
+        self.turns += 1
+        if not self.finished:
+            self.scheduler.next()
+
+
+def simulate(allies, enemies, seed, max_turns=1000, atb=False):
+
+    """ Plays out a battle between copies of allies and enemies where everyone picks a random move they can afford.
+        Returns whether the allies won, the number of turns and the hp left on each side. """
+
+    engine = BattleEngine([combatant.copy() for combatant in allies + enemies], seed, atb)
+    while not engine.finished and engine.turns < max_turns:
+        actor = engine.current
+        moves = [move for move in actor.moves if move.mp_cost <= actor.mp]
+        if moves:
+            engine.command(engine.random.choice(moves))
+            engine.hit()
+        engine.end_turn()
+    ally_hp = sum(combatant.hp for combatant in engine.combatants if combatant.ally)
+    enemy_hp = sum(combatant.hp for combatant in engine.combatants if not combatant.ally)
+    return bool(engine.allies_won), engine.turns, ally_hp, enemy_hp
+
+
+# Dtype of each batch result.
+STATS = {'won': np.bool_, 'turns': np.int32, 'ally_hp': np.int32, 'enemy_hp': np.int32}
+
+
+def simulate_chunk(allies, enemies, seeds, max_turns, atb):
+    # Simulates a battle for every seed. Results are packed into NumPy arrays, which are cheap to send between
+    # processes.
+    stats = {name: np.empty(len(seeds), dtype) for name, dtype in STATS.items()}
+    for i, seed in enumerate(seeds):
+        stats['won'][i], stats['turns'][i], stats['ally_hp'][i], stats['enemy_hp'][i] = \
+            simulate(allies, enemies, seed, max_turns, atb)
+    return stats
+
+
+def simulate_batch(allies, enemies, battles, seed=0, workers=None, chunk_size=2000, max_turns=1000, atb=False):
+
+    """ Simulates battles battles spread over a process pool, or in this process when workers is 0.
+        Battle i uses seed + i, so a batch gives the same results however it is split up.
+        Returns NumPy arrays with an entry per battle: won, turns, ally_hp and enemy_hp. """
+
+    chunks = [range(start, min(start + chunk_size, seed + battles)) for start in range(seed, seed + battles, chunk_size)]
+    if workers == 0:
+        results = [simulate_chunk(allies, enemies, seeds, max_turns, atb) for seeds in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(simulate_chunk, allies, enemies, seeds, max_turns, atb) for seeds in chunks]
+            results = [future.result() for future in futures]
+    return {name: np.concatenate([chunk[name] for chunk in results] or [np.empty(0, dtype)])
+            for name, dtype in STATS.items()}
+
+
+def fursa_stats():
+    return Combatant('FURSA', spawn=2, speed=3, hp=10, mp=10, moves=[ATTACK, SPIRIT_BLAST], ally=True)
+
+
+def skeleton_stats():
+    return Combatant('SKELETON', spawn=4, speed=1, hp=10, mp=10, moves=[SLASH], ally=False)
+
+
+if __name__ == '__main__':
+    # Balance report of the Map02 battle, or of a larger one with copies of each side.
+    parser = argparse.ArgumentParser(description='Simulate battles of Fursa against skeletons.')
+    parser.add_argument('battles', nargs='?', type=int, default=100000)
+    parser.add_argument('--workers', type=int, help='processes to use, 0 to run in this one')
+    parser.add_argument('--party', type=int, default=1, help='combatants on each side')
+    parser.add_argument('--atb', action='store_true', help='use ATB turns')
+    options = parser.parse_args()
+    battles = options.battles
+    allies = [fursa_stats() for i in range(options.party)]
+    enemies = [skeleton_stats() for i in range(options.party)]
+    start = perf_counter()
+    stats = simulate_batch(allies, enemies, battles, workers=options.workers, atb=options.atb)
+    elapsed = perf_counter() - start
+    print('%d battles in %.2f s (%.0f battles/s)' % (battles, elapsed, battles / elapsed))
+    print('win rate %.3f  mean turns %.2f  mean hp left %.2f' % (stats['won'].mean(), stats['turns'].mean(),
+                                                                  stats['ally_hp'].mean()))
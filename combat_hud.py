@@ -0,0 +1,70 @@
+import pygame as pg
+
+
+# Retained battle UI widget.
+# Keeps the rendered text of one UI box along with the values it was rendered from.
+# Text is only rendered again when those values change, and the box is only blitted again when it was
+# rendered again or when the map was refreshed underneath it.
+class HudWidget:
+    def __init__(self, rect, render):
+        # Screen rect of the box the widget is drawn in.
+        self.rect = pg.Rect(rect)
+        # render(key) returns a list of (surface, screen position, area) for the given values, ready for Surface.blits.
+        self.render = render
+        self.key = None
+        self.items = []
+
+    def draw(self, screen, game_map, camera, key, redrawn_rects):
+
+        """ Draws the widget for the values in key. redrawn_rects are the screen rects whose background
+            was refreshed this frame, or None if the whole screen was.
+            Returns the widget rect if the whole widget was redrawn and None otherwise. """
+
+        if key != self.key:
+            self.key = key
+            self.items = self.render(key)
+            # Clear the old text by refreshing the box background before blitting the new text.
+            if redrawn_rects is not None:
+                game_map.draw_back(screen, camera, [self.rect])
+                game_map.draw_front(screen, camera, [self.rect])
+            screen.blits(self.items, doreturn=False)
+            return self.rect
+
+        if redrawn_rects is None:
+            screen.blits(self.items, doreturn=False)
+            return None
+
+        # Only blit the text back onto the parts of the box whose background was refreshed.
+        for rect in redrawn_rects:
+            area = self.rect.clip(rect)
+            if not area:
+                continue
+            for surface, position, source in self.items:
+                part = pg.Rect(position, source.size).clip(area)
+                if part:
+                    screen.blit(surface, part, part.move(source.x - position[0], source.y - position[1]))
+        return None
+
+
+def wrap_description(text):
+    # Wrap text multiple times. Shown as a short paragraph.
+    # Lines are broken on the first space after 25 characters, or the last one before 30.
+    lines = []
+    e = 0
+    i = 0
+    old_i = 0
+    while i <= len(text):
+        i = old_i + 25
+        if i <= len(text):
+            while text[i] != ' ':
+                i += 1
+                if i > old_i + 30:
+                    while text[i] != ' ':
+                        i -= 1
+                    break
+            lines.append(text[e:i])
+            old_i = i
+            e = i + 1
+        else:
+            lines.append(text[e:i])
+    return lines
@@ -1,5 +1,10 @@
 import pygame as pg
-from operator import itemgetter
+from combat_hud import HudWidget, wrap_description
+from text_engine import text_engine
+from game_input import game_input
+from combat_engine import BattleEngine, ATTACK, SPIRIT_BLAST
+from battle_arena import battle_arenas
+from frame_cache import FrameCache
 
 
 # Takes care of the combat system in map classes.
@@ -12,24 +17,27 @@ class CombatSystem:
         self.combat_box_rect = pg.Rect((720, 750), (690, 300))
         self.description_box = package['descriptionBox']
         self.description_rect = pg.Rect((1410, 750), (460, 300))
+        self.status_rect = pg.Rect((50, 750), (670, 300))
         self.pointer = package['pointer']
         self.point_rect = self.pointer.get_rect()
         self.combat_font = package['combatFont']
         self.hpmp_font = package['hpmpFont']
         self.battle_sword_aftersound = package['battleNoises'][0]
         self.battle_impact_noise = package['battleNoises'][1]
+        # Battle intro pauses are timed by the simulation clock so they are not slept when fast forwarding.
+        self.timestep = package['timestep']
         self.battle_impact_noise.set_volume(0.50)
 
-        # Battle Transition Screen.
-        resolution = width, height = 1920, 1080
-        black = (0, 0, 0)
-        self.battle_transition_screen = pg.Surface(resolution)
-        self.battle_transition_screen.fill(black)
+        # Arena file of the battles fought in the map. The arena is only built once a battle starts.
+        self.battle_scene = None
+        # Map left for the battle and where Fursa and the enemies stood in it, to go back to once it is over.
+        self.world_map = None
+        self.world_positions = {}
 
         # States.
         self.battle_init = True
-        self.turn_order = []
-        self.turn_i = 0
+        # Combat rules of the battle underway.
+        self.engine = None
         self.battle_command = 0
         self.action_select = False
         self.animation_complete = True
@@ -39,68 +47,88 @@ class CombatSystem:
 
         # Move selection highlighter.
         self.current_slot = 1
+        self.new_slot = 1
+
+        # Glyph atlases of the battle UI text.
         white = (255, 255, 255)
         black = (0, 0, 0)
-        attack_select = white
-        bag_select = black
-        run_select = black
-        spell_select = black
-        self.combat_selector = {1: attack_select,
-                                2: bag_select,
-                                3: run_select,
-                                4: spell_select}
-
-    def combat_descrip(self, text, screen):
-        # Function to render and blit combat move descriptions.
-        rep = 0
-        new_text = []
-        e = 0
-        i = 0
-        old_i = 0
-        # Wrap text multiple times. Shown as a short paragraph.
-        # Algorithm is coded to show text immediately.
-        while i <= len(text):
-            i = old_i + 25
-            if i <= len(text):
-                while text[i] != ' ':
-                    i += 1
-                    if i > old_i + 30:
-                        while text[i] != ' ':
-                            i -= 1
-                        break
-                new_text.append(text[e:i])
-                combat_text = new_text[rep]
-                combat_descrip, rect = self.dialog_font.render(combat_text)
-                screen.blit(combat_descrip, (1430, 800 + 50 * rep))
-                rep += 1
-                old_i = i
-                e = i + 1
-            else:
-                new_text.append(text[e:i])
-                combat_text = new_text[rep]
-                combat_descrip, rect = self.dialog_font.render(combat_text)
-                screen.blit(combat_descrip, (1430, 800 + 50 * rep))
+        dialog_font = package['dialogFont']
+        self.name_text = text_engine.atlas(dialog_font, 36, black)
+        self.level_text = text_engine.atlas(dialog_font, 18, black)
+        self.hp_text = text_engine.atlas(dialog_font, 30, (139, 0, 0))
+        self.mp_text = text_engine.atlas(dialog_font, 30, (0, 0, 139))
+        self.hpmp_text = text_engine.atlas(self.hpmp_font, 48, black)
+        self.slot_text = {True: text_engine.atlas(dialog_font, 36, white),
+                          False: text_engine.atlas(dialog_font, 36, black)}
+        self.description_text = text_engine.atlas(dialog_font)
+
+        # Battle UI. Each box is only laid out again when the values shown in it change.
+        self.status_widget = HudWidget(self.status_rect, self.render_status)
+        self.slot_widget = HudWidget(self.combat_box_rect, self.render_slots)
+        self.description_widget = HudWidget(self.description_rect, self.combat_descrip)
+
+    def render_status(self, key):
+        # Fursa's name, level, HP and MP in the status box.
+        level, current_hp, max_hp, current_mp, max_mp = key
+        return (self.name_text.blit_items('FURSA', (80, 800)) +
+                self.level_text.blit_items('Lvl.%x' % level, (210, 815)) +
+                self.hp_text.blit_items('HP:', (300, 805)) +
+                self.hpmp_text.blit_items('%s/%s' % (str(current_hp), str(max_hp)), (370, 805)) +
+                self.mp_text.blit_items('MP:', (500, 805)) +
+                self.hpmp_text.blit_items('%s/%s' % (str(current_mp), str(max_mp)), (570, 805)))
+
+    def render_slots(self, key):
+        # Combat button labels in the combat UI box. The highlighted slot is white.
+        labels, current_slot = key
+        items = []
+        for slot in range(1, 5):
+            slot_text = self.slot_text[slot == current_slot]
+            rect = slot_text.get_rect(labels[slot - 1])
+            coordinates = [(850 - int((rect.width - 150) / 2), 830), (1150 - int((rect.width - 150) / 2), 830),
+                           (1150 - int((rect.width - 150) / 2), 930), (850 - int((rect.width - 150) / 2), 930)]
+            items += slot_text.blit_items(labels[slot - 1], coordinates[slot - 1])
+        return items
+
+    def combat_descrip(self, text):
+        # Combat move descriptions as a wrapped paragraph in the description box.
+        items = []
+        for rep, combat_text in enumerate(wrap_description(text)):
+            items += self.description_text.blit_items(combat_text, (1430, 800 + 50 * rep))
+        return items
 
     def battle_transition(self, screen, sprites, fursa, current_enemy):
 
         # Set frame to a hit frame.
         fursa.image = fursa.all_frames[6][2]
 
-        # Pause impact frame for 1s.
+        # Pause impact frame for 1s. Frames that are not drawn when fast forwarding show nothing.
         self.battle_impact_noise.play()
         pg.mixer.music.stop()
-        sprites['enemy'].draw(screen)
-        sprites['character'].draw(screen)
-        screen.blit(self.map.front_surface, (0, 0))
-        pg.display.flip()
-        pg.time.wait(1000)
+        if self.frame_drawn:
+            self.camera.draw(screen, sprites['enemy'])
+            self.camera.draw(screen, sprites['character'])
+            self.map.draw_front(screen, self.camera)
+            pg.display.flip()
+        # Battle map and spawn locations. The arena is shared with every map fighting in it.
+        # It is built during the pause, which is shortened by the time building it took.
+        build_start = pg.time.get_ticks()
+        self.battle_map = battle_arenas.arena(self.battle_scene, [(self.status_box, (50, 750)),
+                                                                  (self.combat_box, (720, 750)),
+                                                                  (self.description_box, (1410, 750))],
+                                              FrameCache(self.fi))
+        self.battle_spawn_pos = self.battle_map.battle_spawns
+        self.timestep.wait(1000 - (pg.time.get_ticks() - build_start))
         # Clear background to black for 1s.
-        screen.blit(self.battle_transition_screen, (0, 0))
-        sprites['enemy'].draw(screen)
-        sprites['character'].draw(screen)
-        pg.display.flip()
+        if self.frame_drawn:
+            screen.blit(battle_arenas.transition_screen(screen.get_size()), (0, 0))
+            self.camera.draw(screen, sprites['enemy'])
+            self.camera.draw(screen, sprites['character'])
+            pg.display.flip()
         self.battle_sword_aftersound.play()
-        pg.time.wait(1000)
+        self.timestep.wait(1000)
+
+        # Remember where everyone stood before being moved onto the battle platform.
+        self.world_positions = {sprite: sprite.rect.topleft for sprite in sprites['enemy'].sprites() + [fursa]}
 
         # Initiate music.
         self.fi.cd('Maps Map_02')
@@ -122,6 +150,78 @@ class CombatSystem:
         current_enemy.rect.centerx = self.battle_spawn_pos[current_enemy.party_spawn].centerx
         current_enemy.rect.centery = self.battle_spawn_pos[current_enemy.party_spawn].centery
 
+    def battle_step(self):
+
+        """ Turn changer code. Called once per simulation step during battles,
+            so turns and the pointer animation run at the same speed however fast frames are drawn. """
+
+        if self.engine is None:
+            return
+        if self.animation_complete is True and self.change_turn is False:
+            self.pointer_frame = (self.pointer_frame + 1) % 62
+        # Hide the pointer during animations. Uses self.change_turn as a one shot.
+        elif self.animation_complete is False and self.change_turn is False:
+            self.change_turn = True
+        # Once animation is complete and sprite has changed battle_command back to 0, change the current_turn.
+        elif self.animation_complete is True and self.battle_command == 0:
+            self.change_turn = False
+            self.engine.end_turn()
+            self.current_turn = self.engine.current
+
+    def battle_over(self, enemy_sprites):
+        # True once the battle is decided and every animation, including the deaths of fallen enemies, has played out.
+        return (self.engine is not None and self.engine.finished and self.animation_complete and
+                self.battle_command == 0 and self.change_turn is False and
+                not any(not enemy.combatant.alive for enemy in enemy_sprites))
+
+    def battle_end(self, fursa, sprites):
+
+        """ Leaves the battle map once the battle is over.
+            After a victory Fursa goes back to where the battle started and keeps the HP and MP she has left.
+            After a defeat she respawns at the map's spawn location, or where the battle started if the map has none,
+            and everyone is healed. The surviving enemies go back to where they stood, no longer aggroed. """
+
+        won = self.engine.allies_won
+        self.map = self.world_map
+        self.blockers = self.map.blockers
+        self.blocker_index = self.map.blocker_index
+        self.camera.set_bounds(self.map.width, self.map.height)
+        sprites['particles'].empty()
+
+        for enemy in sprites['enemy']:
+            if not won:
+                enemy.combatant.hp, enemy.combatant.mp = enemy.combatant.max_hp, enemy.combatant.max_mp
+            enemy.leave_battle(self.world_positions.get(enemy, enemy.rect.topleft))
+        fursa.rect.topleft = self.world_positions[fursa]
+        if not won:
+            fursa.combatant.hp, fursa.combatant.mp = fursa.combatant.max_hp, fursa.combatant.max_mp
+            if self.spawn is not None:
+                fursa.rect.topleft = self.spawn
+        fursa.leave_battle()
+
+        # Back to the map's music, if it has any.
+        pg.mixer.music.stop()
+        if self.music_path is not None:
+            pg.mixer.music.load(self.music_path)
+            pg.mixer.music.play(loops=-1, start=0.0)
+
+        # Reset states for the next battle. The screen is redrawn on the next frame.
+        self.battle = False
+        self.battle_init = True
+        self.engine = None
+        self.current_turn = None
+        self.battle_command = 0
+        self.action_select = False
+        self.animation_complete = True
+        self.change_turn = False
+        self.pointer_frame = 0
+        self.current_slot = self.new_slot = 1
+        self.world_map = None
+        self.world_positions = {}
+        self.refresh_rects = []
+        self.ui = []
+        fursa.battle_forward = True
+
     """ Battle Platform Layout.
                                               Midpoint for Ranged Attacks
                                   Ally                       |                  Enemies
@@ -142,88 +242,46 @@ Spawn Location Indexes    ------0---------1-----------2----------6-----------4--
         self.refresh_rects = [pg.Rect((spawn.centerx - 30, spawn.y + 80), (60, 60)) for spawn in
                               self.battle_spawn_pos]
 
-        # Initiate Fursa's UI text and print.
-        white = (255, 255, 255)
-        black = (0, 0, 0)
-        fursa_name, rect = self.dialog_font.render('FURSA', fgcolor=black, size=36)
-        fursa_lvl, rect = self.dialog_font.render('Lvl.%x' % fursa.level, fgcolor=black, size=18)
-        fursa_HP, rect = self.dialog_font.render('HP:', fgcolor=(139, 0, 0), size=30)
-        fursa_MP, rect = self.dialog_font.render('MP:', fgcolor=(0, 0, 139), size=30)
-        fursa_hpnum, rect = self.hpmp_font.render('%s/%s' % (str(fursa.current_hp), str(fursa.max_hp)),
-                                                  fgcolor=black, size=48)
-        fursa_mpnum, rect = self.hpmp_font.render('%s/%s' % (str(fursa.current_mp), str(fursa.max_mp)),
-                                                  fgcolor=black, size=48)
-        screen.blit(fursa_name, (80, 800))
-        screen.blit(fursa_lvl, (210, 815))
-        screen.blit(fursa_HP, (300, 805))
-        screen.blit(fursa_hpnum, (370, 805))
-        screen.blit(fursa_MP, (500, 805))
-        screen.blit(fursa_mpnum, (570, 805))
-
-        # Print combat button labels in combat UI box.
-        # self.action_select as a bool is used to determine whether the general actions or spell actions should be printed.
-        # self.combat_selector determines the color.
-        for slot in range(1, 5):
-            slot_button, rect = self.dialog_font.render(self.slot_labels[slot][self.action_select],
-                                                        fgcolor=self.combat_selector[slot], size=36)
-            coordinates = [(850 - int((rect.width - 150) / 2), 830), (1150 - int((rect.width - 150) / 2), 830),
-                           (1150 - int((rect.width - 150) / 2), 930), (850 - int((rect.width - 150) / 2), 930)]
-            screen.blit(slot_button, coordinates[slot - 1])
-
-        self.ui = [self.combat_box_rect, self.description_rect]
-        # Print the combat description of the current highlighted move in the description box.
-        self.combat_descrip(self.combat_descriptions[self.current_slot][self.action_select], screen)
-
         """ Initialize battle parameters at the start of battle once.
-            Determines the turn order by comparing characters' and enemies' turn_determiners,
-            where turn_determiner = [spawn location, speed].
-            The speed is used to order the turn_determiners into self.turn_order from high to low.
-            As the self.current_turn is updated by an increasing self.turn_i, the corresponding
-            spawn location of the selected turn_determiner is then used to identify which sprite is
-            the one that is allowed to perform an action. """
+            The combat engine orders the turns of Fursa and the enemies by speed and keeps their HP and MP.
+            self.current_turn is the combatant whose turn it is, which is used to
+            identify which sprite is the one that is allowed to perform an action. """
 
         if self.battle_init:
             # Switch map and blockers to battle map.
+            self.world_map = self.map
             self.map = self.battle_map
             self.blockers = self.map.blockers
-            for enemy in enemy_sprites:
-                self.turn_order.append(enemy.turn_determiner)
-            self.turn_order.append(fursa.turn_determiner)
-            self.turn_order = sorted(self.turn_order, key=itemgetter(1), reverse=True)
-            self.current_turn = self.turn_order[self.turn_i][0]
+            self.blocker_index = self.map.blocker_index
+            self.camera.set_bounds(self.map.width, self.map.height)
+            # Seeded with the simulated time the battle starts at, so a replayed session rolls the same damage.
+            self.engine = BattleEngine([enemy.combatant for enemy in enemy_sprites] + [fursa.combatant],
+                                       seed=self.timestep.time)
+            self.current_turn = self.engine.current
             self.battle_init = False
 
-        # Turn changer code & Turn and enemy selection pointer.
-        # Only show the pointer while choosing a move.
-        if self.animation_complete is True and self.change_turn is False:
-            if self.pointer_frame <= 30:
-                self.pointer_frame += 1
-                # Display the pointer above the sprite using its battle_spawn_pos if it is the correct current_turn.
-                screen.blit(self.pointer,
-                            (self.battle_spawn_pos[self.current_turn].centerx - self.point_rect.width / 2,
-                             self.battle_spawn_pos[self.current_turn].centery + 80))
-            # Create a bobbing up and down effect.
-            elif self.pointer_frame <= 60:
-                self.pointer_frame += 1
-                screen.blit(self.pointer,
-                            (self.battle_spawn_pos[self.current_turn].centerx - self.point_rect.width / 2,
-                             self.battle_spawn_pos[self.current_turn].centery + 90))
-            else:
-                self.pointer_frame = 0
-                screen.blit(self.pointer,
-                            (self.battle_spawn_pos[self.current_turn].centerx - self.point_rect.width / 2,
-                             self.battle_spawn_pos[self.current_turn].centery + 80))
-        # Hide during animations. Uses self.change_turn as a one shot.
-        elif self.animation_complete is False and self.change_turn is False:
-            # Increase turn_i in preparation of the next turn.
-            self.turn_i += 1
-            self.change_turn = True
-            if self.turn_i == len(self.turn_order):
-                self.turn_i = 0
-        # Once animation is complete and sprite has changed battle_command back to 0, change the current_turn.
-        elif self.animation_complete is True and self.battle_command == 0:
-            self.change_turn = False
-            self.current_turn = (self.turn_order[self.turn_i])[0]
+        # Fursa's status, the combat button labels and the description of the highlighted move.
+        # self.action_select as a bool is used to determine whether the general actions or spell actions are shown.
+        # Only the boxes that were redrawn are added to self.ui.
+        labels = tuple(self.slot_labels[slot][self.action_select] for slot in range(1, 5))
+        stats = fursa.combatant
+        widgets = [(self.status_widget, (fursa.level, stats.hp, stats.max_hp, stats.mp, stats.max_mp)),
+                   (self.slot_widget, (labels, self.current_slot)),
+                   (self.description_widget, self.combat_descriptions[self.current_slot][self.action_select])]
+        self.ui = []
+        for widget, key in widgets:
+            rect = widget.draw(screen, self.map, self.camera, key, self.redrawn_rects)
+            if rect is not None:
+                self.ui.append(rect)
+
+        # Turn and enemy selection pointer. Only shown while choosing a move.
+        # Bobs up and down with the pointer frame, which is advanced along with the turns in battle_step.
+        # No one has the turn if the combatant whose turn it was fell during it, until the turn is passed on.
+        if self.animation_complete is True and self.change_turn is False and self.current_turn is not None:
+            spawn = self.battle_spawn_pos[self.current_turn.spawn]
+            bob = 90 if self.pointer_frame > 31 else 80
+            # Display the pointer above the sprite using its battle_spawn_pos if it is the correct current_turn.
+            screen.blit(self.pointer, (spawn.centerx - self.point_rect.width / 2, spawn.centery + bob))
 
         """ 1 : Attack | 2 : Bag      Action UI Selector goes by clockwise slots increasing state IDs.
             -----------------------
@@ -235,17 +293,17 @@ Spawn Location Indexes    ------0---------1-----------2----------6-----------4--
                 3. Selecting the target of the spell, attack, or item.
 
             self.action_select is a bool used to distinguish between the general actions(false) and spell actions(true).
-            self.current_select acts as an index for self.combat_selector that determines which action is highlighted white.
+            self.current_slot is the action that is highlighted white.
             The key r is used to move forward while key e is used to navigate backwards. """
 
         # Pygame event loop activates ONLY during battles.
-        for event in pg.event.get():
+        for event in game_input.events():
 
             if event.type == pg.KEYDOWN:
 
                 # If it is an ally or Fursa's turn, allow keyboard input.
-                # The number 2 represents spawn_pos 0, 1, 2.
-                if self.current_turn <= 2:
+                current = self.engine.current
+                if current is not None and current.ally and not self.engine.finished:
 
                     # Spell selector screen.
                     if self.action_select is True:
@@ -255,8 +313,8 @@ Spawn Location Indexes    ------0---------1-----------2----------6-----------4--
                             self.new_slot = 1
                             self.dialog_noise.play()
                         elif self.current_slot == 1:
-                            if event.key == pg.K_r:
-                                # Create a spell in character sprite.
+                            # Create a spell in character sprite if there is enough mana.
+                            if event.key == pg.K_r and self.engine.command(SPIRIT_BLAST):
                                 self.battle_command = 2
                                 self.action_select = False
                                 self.new_slot = 1
@@ -275,7 +333,7 @@ Spawn Location Indexes    ------0---------1-----------2----------6-----------4--
                             elif event.key == pg.K_d:
                                 self.new_slot = 2
                             # Attack command.
-                            elif event.key == pg.K_r:
+                            elif event.key == pg.K_r and self.engine.command(ATTACK):
                                 self.battle_command = 1
                         # Spell selection.
                         elif self.current_slot == 4:
@@ -300,10 +358,8 @@ Spawn Location Indexes    ------0---------1-----------2----------6-----------4--
                             elif event.key == pg.K_w:
                                 self.new_slot = 2
 
-                    # If a change has been made, update selector colors.
+                    # If a change has been made, move the highlighter.
                     if self.new_slot != self.current_slot:
-                        self.combat_selector[self.current_slot] = black
-                        self.combat_selector[self.new_slot] = white
                         self.current_slot = self.new_slot
                         self.dialog_noise.play()
 
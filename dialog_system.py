@@ -1,5 +1,6 @@
 import pygame as pg
 import pathlib
+from text_engine import text_engine
 
 
 # Takes care of the dialog system in map classes.
@@ -13,14 +14,14 @@ class DialogSystem:
         self.dialog_start = True
         self.dialog_box = package['dialogBox']
         self.dialog_font = package['dialogFont']
+        self.dialog_text = text_engine.atlas(self.dialog_font)
         self.dialog_noise = package['dialogNoise']
-        self.dialog_1_final = ''
-        self.dialog_2_final = ''
-        self.dialog_name_final = ''
-        self.dialog_length = ''
+        # Lines of the current dialogue and the frame each line starts typing on.
+        self.dialog_lines = []
+        self.dialog_name = ''
+        self.dialog_length = 0
+        # Simulation steps since the current dialogue started.
         self.e = 0
-        self.a = 0
-        self.i = 0
 
     @staticmethod
     def black_edges(screen):
@@ -29,71 +30,53 @@ class DialogSystem:
         pg.draw.rect(screen, black, (0, 0, 1920, 200))
         pg.draw.rect(screen, black, (0, 880, 1920, 200))
 
+    def dialog_layout(self, text, name):
+
+        """ Lays out a dialogue line once when it starts.
+            Glyphs come from the dialog font's atlas, so typing only blits the glyphs shown so far
+            instead of rendering the text again every frame. """
+
+        # If text is long, wrap the text. Otherwise, simply print.
+        if len(text) > 50:
+            i = 50
+            # Properly wrap text in the dialogue box by detecting spaces.
+            # Text will only ever be two lines.
+            while text[i] != ' ':
+                i += 1
+            if i > 52:
+                i = 50
+                while text[i] != ' ':
+                    i -= 1
+            lines = [text[0:i], text[i+1:]]
+        else:
+            lines = [text]
+
+        self.dialog_lines = []
+        start = 0
+        for line in lines:
+            self.dialog_text.layout(line)
+            self.dialog_lines.append((line, start))
+            # The next line starts typing as the last character of this one appears.
+            start += len(line) - 1
+        self.dialog_name = name
+        self.dialog_length = len(text)
+
+    def dialog_step(self):
+        # Types one more character of the dialogue. Called once per simulation step during cutscenes.
+        if self.e <= self.dialog_length:
+            self.e += 1
+
     def dialog(self, text, name, screen):
-        # Function to render and blit dialogue.
+        # Function to blit dialogue. Text is "typed" one character per simulation step by dialog_step.
         self.black_edges(screen)
         screen.blit(self.dialog_box, (550, 880))
         if self.dialog_start:
             self.dialog_noise.play()
+            self.dialog_layout(text, name)
             self.e = 0
-            self.a = 0
-            self.dialog_length = len(text)
-            # If text is long, wrap the text. Otherwise, simply print.
-            if len(text) > 50:
-                self.i = 50
-                # Properly wrap text in the dialogue box by detecting spaces.
-                # Text will only ever be two lines.
-                # Algorithm is coded so that dialogue is "typed".
-                while text[self.i] != ' ':
-                    self.i += 1
-                if self.i > 52:
-                    self.i = 50
-                    while text[self.i] != ' ':
-                        self.i -= 1
-
-        # Render text one by one until length is reached for single or double line dialog.
-        if self.e != (len(text) + 1):
-            if self.a == 0 or self.a != self.dialog_length:
-                if len(text) > 50:
-                    new_text = [text[0:self.i], text[self.i+1:]]
-                    load_text_1 = new_text[0][0:self.e]
-                    load_text_2 = new_text[1][0:self.a]
-                    dialog_text_1, rect_1 = self.dialog_font.render(load_text_1)
-                    dialog_text_2, rect_2 = self.dialog_font.render(load_text_2)
-                    screen.blit(dialog_text_1, (600, 955))
-                    screen.blit(dialog_text_2, (600, 1005))
-                    self.e += 1
-                    if self.e >= self.i:
-                        self.a += 1
 
-                    # Print the speaker's name.
-                    name_text, rect_3 = self.dialog_font.render(name)
-                    screen.blit(name_text, (600, 905))
+        for (line, start), y in zip(self.dialog_lines, (955, 1005)):
+            self.dialog_text.draw(screen, line, (600, y), max(self.e - start, 0))
 
-                    # Store completed rendered text.
-                    self.dialog_1_final = dialog_text_1
-                    self.dialog_2_final = dialog_text_2
-                    self.dialog_name_final = name_text
-
-                else:
-                    load_text_1 = text[0:self.e]
-                    dialog_text_1, rect_1 = self.dialog_font.render(load_text_1)
-                    screen.blit(dialog_text_1, (600, 955))
-                    self.e += 1
-
-                    dialog_text_2, rect_2 = self.dialog_font.render('')
-
-                    # Print the speaker's name.
-                    name_text, rect_3 = self.dialog_font.render(name)
-                    screen.blit(name_text, (600, 905))
-
-                    # Store completed rendered text.
-                    self.dialog_1_final = dialog_text_1
-                    self.dialog_2_final = dialog_text_2
-                    self.dialog_name_final = name_text
-
-        # If line by line render is done, simply blit the final text so avoid needless rendering.
-        else:
-            screen.blit(self.dialog_1_final, (600, 955))
-            screen.blit(self.dialog_2_final, (600, 1005))
-            screen.blit(self.dialog_name_final, (600, 905))
+        # Print the speaker's name.
+        self.dialog_text.draw(screen, self.dialog_name, (600, 905))
@@ -0,0 +1,69 @@
+import pygame as pg
+
+
+# Dirty region manager for the main loop.
+# Collects the screen rects that have to be refreshed in a frame and merges overlapping or nearly touching
+# rects into a small set of rects that do not overlap, so no pixel is redrawn and sent to the display more than once.
+# When the merged area covers most of the screen a single full screen rect is used instead.
+class DirtyRegions:
+    def __init__(self, screen_rect, margin=16, max_waste=0.25, full_ratio=0.6):
+        self.screen_rect = pg.Rect(screen_rect)
+        # Rects closer than margin pixels are considered adjacent.
+        self.margin = margin
+        # Largest fraction of a merged rect that may be made up of pixels neither rect covered.
+        self.max_waste = max_waste
+        # Fraction of the screen above which the whole screen is refreshed.
+        self.full_area = self.screen_rect.width * self.screen_rect.height * full_ratio
+        # Statistics of the last merge.
+        self.full = False
+        self.raw_area = 0
+        self.area = 0
+        self.saved_area = 0
+        self.count = 0
+
+    def should_merge(self, a, b):
+        # Overlapping rects are always merged so that the merged rects never overlap and no pixel
+        # of the alpha blended front surface is blitted twice.
+        if a.colliderect(b):
+            return True
+        if not a.inflate(self.margin * 2, self.margin * 2).colliderect(b):
+            return False
+        union = a.union(b)
+        union_area = union.width * union.height
+        overlap = a.clip(b)
+        covered = a.width * a.height + b.width * b.height - overlap.width * overlap.height
+        return union_area - covered <= union_area * self.max_waste
+
+    def merge(self, rects):
+
+        """ Returns the merged rects covering every rect in rects, clipped to the screen.
+            Sets self.full and returns the whole screen if the merged area is above the full screen threshold.
+            self.saved_area is the number of pixels not redrawn compared to refreshing every rect separately. """
+
+        merged = []
+        raw_area = 0
+        for rect in rects:
+            rect = self.screen_rect.clip(rect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            raw_area += rect.width * rect.height
+            # Keep merging until the rect no longer touches any merged rect.
+            i = 0
+            while i < len(merged):
+                if self.should_merge(merged[i], rect):
+                    rect = rect.union(merged.pop(i))
+                    i = 0
+                else:
+                    i += 1
+            merged.append(rect)
+
+        area = sum(rect.width * rect.height for rect in merged)
+        self.full = area > self.full_area
+        if self.full:
+            merged = [self.screen_rect.copy()]
+            area = self.screen_rect.width * self.screen_rect.height
+        self.raw_area = raw_area
+        self.area = area
+        self.saved_area = raw_area - area
+        self.count = len(merged)
+        return merged
@@ -1,8 +1,11 @@
 import pygame as pg
+from physics import sweep
+from frame_variants import frame_variants
+from combat_engine import skeleton_stats
 
 
 class Skeleton(pg.sprite.Sprite):
-    def __init__(self, frames, spawnx, spawny, fi):
+    def __init__(self, frames, spawnx, spawny, fi, swing_sound=None):
         super().__init__()
         self.fi = fi
 
@@ -16,8 +19,10 @@ class Skeleton(pg.sprite.Sprite):
         self.frame_speed = 100
         self.frame_index = 0
 
-        # Sprite rect init.
+        # Sprite rect init. Hitbox and refresh rect are updated every step in update.
         self.rect = pg.Rect(spawnx, spawny, 72, 96)
+        self.hitbox_rect = pg.Rect((self.rect.x, self.rect.y + 25), (52, 72))
+        self.refresh_rect = pg.Rect((self.rect.x - 128, self.rect.y - 64), (256, 256))
 
         # States.
         self.prev_state = 0
@@ -38,21 +43,18 @@ class Skeleton(pg.sprite.Sprite):
         self.frame_dt = 0
         self.pre_engaged_dt = 0
 
-        # Combat attributes.
-        self.current_hp = 10
-        self.current_mp = 10
-        self.max_hp = 10
-        self.max_mp = 10
-        self.party_spawn = 4
-        self.speed = 1
+        # Combat attributes. HP, MP, speed and moves are used by the combat engine.
+        self.combatant = skeleton_stats()
+        self.party_spawn = self.combatant.spawn
         self.turn = False
         self.first_attack = True
         self.hit_done = False
-        self.turn_determiner = [self.party_spawn, self.speed]
 
-        # Load sound effects.
-        self.fi.cd("Enemies Skeleton")
-        self.swing_sound = pg.mixer.Sound(self.fi.path('swing.wav'))
+        # Load sound effects. Uses the already loaded sound if one was given.
+        if swing_sound is None:
+            self.fi.cd("Enemies Skeleton")
+            swing_sound = pg.mixer.Sound(self.fi.path('swing.wav'))
+        self.swing_sound = swing_sound
 
     # Skeleton AI.
     def AI(self, time, dt, fursa, particle_sprites):
@@ -113,9 +115,9 @@ class Skeleton(pg.sprite.Sprite):
                     self.chase = True
                     self.aggroed = True
                     self.hit = True
-                    self.current_hp -= 1
+                    self.combatant.hp -= 1
 
-        if self.current_hp <= 0:
+        if not self.combatant.alive:
             self.state = 5
 
         # Monitor state changes to change rect appropriately.
@@ -178,24 +180,35 @@ class Skeleton(pg.sprite.Sprite):
                                                  (self.hitbox_rect.y + self.hitbox_rect.height/2)):
                 self.change_state(4)
                 self.frame_index = 0
+                map.engine.hit()
 
-        # Reacts to Fursa's melee attack.
+        # Reacts to Fursa's melee attack. Damage is dealt on the frame it connects.
         if fursa.attack is True:
             if fursa.rect.colliderect(self.hitbox_rect) and fursa.frame_index == 8:
                 self.change_state(4)
                 self.frame_index = 0
+                map.engine.hit()
 
         # Idle when it is not skeleton's current turn and a hit reaction is not underway.
-        if map.current_turn != self.party_spawn and self.hit_done is True:
+        if map.current_turn is not self.combatant and self.hit_done is True:
             self.change_state(0)
 
+        # Die once the hit reaction to the final blow is over.
+        if not self.combatant.alive and self.hit_done is True:
+            self.change_state(5)
+
         # When it is skeleton's turn, go up for a melee attack.
-        # self.first_attack serves as a one shot.
-        if map.current_turn == self.party_spawn and self.first_attack:
+        # self.first_attack serves as a one shot. No more attacks once the battle is over.
+        if map.current_turn is self.combatant and self.first_attack and not map.engine.finished:
+            map.engine.command(self.combatant.moves[0])
             map.battle_command = 1
             self.first_attack = False
 
-        if map.current_turn == self.party_spawn and self.hit_done is True:
+        # The swing hits Fursa on its eighth frame.
+        if map.current_turn is self.combatant and self.attack is True and self.frame_index == 8:
+            map.engine.hit()
+
+        if map.current_turn is self.combatant and self.hit_done is True:
             map.animation_complete = False
             if map.battle_command == 1:
                 # Run up to player position and perform attack animation.
@@ -226,6 +239,18 @@ class Skeleton(pg.sprite.Sprite):
             self.pstate = self.prev_state
             self.cstate = self.state
 
+    def leave_battle(self, position):
+        # Puts the skeleton back in the open world at position, idle and no longer aggroed.
+        self.rect.topleft = position
+        self.rect.size = (72, 96)
+        self.state = self.prev_state = 0
+        self.change_state(0)
+        self.change_state_check = False
+        self.frame_index = 0
+        self.aggroed = self.chase = self.attack = self.hit = False
+        self.first_attack = True
+        self.hit_done = False
+
     def update(self, time, dt, map, fursa, particle_sprites):
         """ Main update function. Continuously called at all times in game loop main()
             Updates skeleton's frame and hitbox. Monitors platform interaction.
@@ -268,7 +293,9 @@ class Skeleton(pg.sprite.Sprite):
                 if self.state == 2:
                     pass
                 elif self.state == 5:
+                    # Death animation is over.
                     self.kill()
+                    return
                 # Allows reaction to finish before attack starts.
                 elif self.state == 4:
                     self.hit_done = True
@@ -289,7 +316,7 @@ class Skeleton(pg.sprite.Sprite):
                     self.rect.x += 50
                     self.turn = False
             else:
-                self.image = pg.transform.flip(self.current_frames[self.frame_index], True, False)
+                self.image = frame_variants.flipped(self.current_frames)[self.frame_index]
                 self.frame_index += 1
                 self.frame_override = False
                 if self.turn is False:
@@ -309,31 +336,19 @@ class Skeleton(pg.sprite.Sprite):
                     self.rect.height = 96
 
         # Gravity emulation with current map blockers.
-        for block in map.blockers:
-            # Checks to see if skeleton is in contact with the ground.
-            if self.rect.colliderect(block):
-                self.on_ground = True
-                break
-            else:
-                self.on_ground = False
+        # Checks to see if skeleton is in contact with the ground. Only nearby blockers are tested.
+        self.on_ground = map.blocker_index.collides(self.rect)
 
         if self.on_ground is False:
             # If not in contact with the ground, accelerates falling down every 20 ms by 10%.
             if (time - self.gravity_dt) >= 20:
                 self.gravity_dt = time
                 self.fall_rate *= 1.1
-                start_fall = self.rect.y
-                for i in range(int(self.fall_rate)):
-                    self.rect.y += 1
-                    self.hitbox_rect.y += 1
-                    end_fall = self.rect.y
-                    if (end_fall - start_fall) > 256:
-                        pg.display.update(self.refresh_rect)
-                    # Halts falling when skeleton lands on a block.
-                    for block in map.blockers:
-                        if self.rect.colliderect(block):
-                            self.fall_rate = 1
-                            self.on_ground = True
-                            break
-                    if self.on_ground is True:
-                        break
+                # The whole fall is resolved in one step against the blockers.
+                fall, landed = sweep(self.rect, int(self.fall_rate), map.blocker_index)
+                self.rect.y += fall
+                self.hitbox_rect.y += fall
+                # Halts falling when skeleton lands on a block.
+                if landed:
+                    self.fall_rate = 1
+                    self.on_ground = True
@@ -1,5 +1,7 @@
 import pygame as pg
 from spritesheet import SpriteSheet
+from frame_cache import FrameCache
+from frame_variants import frame_variants
 
 
 class EnemySpriteFrames:
@@ -23,9 +25,16 @@ class EnemySpriteFrames:
 
         self.skeleton_frame_maxes = [len(frame_amount) for frame_amount in coordinates]
 
-        spritesheets = [SpriteSheet(self.fi.path(ss)) for ss in self.fi.file_list()]
-        ss_sep = [ss.images_at(coordinates[i], colorkey=(0, 0, 0)) for i, ss in enumerate(spritesheets)]
+        sources = [self.fi.path(ss) for ss in self.fi.file_list()]
 
-        for i, ss_sep in enumerate(ss_sep):
-            scaled_frames = [pg.transform.scale(ss_sep[e], sizes[i]) for e in range(0, len(ss_sep))]
-            self.skeleton_frames.append(scaled_frames)
+        def build():
+            spritesheets = [SpriteSheet(path) for path in sources]
+            ss_sep = [ss.images_at(coordinates[i], colorkey=(0, 0, 0)) for i, ss in enumerate(spritesheets)]
+            return [[pg.transform.scale(frame, sizes[i]) for frame in frames] for i, frames in enumerate(ss_sep)]
+
+        # Scaled frames are read from the baked frame cache and only rebuilt when a spritesheet has changed.
+        self.skeleton_frames.extend(FrameCache(self.fi).load('skeleton', sources, [coordinates, sizes], build))
+
+        # Left facing frames are built once and shared by every skeleton.
+        for frames in self.skeleton_frames:
+            frame_variants.flipped(frames)
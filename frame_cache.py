@@ -0,0 +1,156 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import pygame as pg
+
+
+# Baked frame cache. Frames are stored on disk already scaled and ready for the display so that
+# startup can skip decoding and rescaling every source image.
+# A cache file holds a small json header followed by the raw pixels of every frame.
+# The header stores a key built from the source file hashes and target sizes. If any source asset
+# changes, the key no longer matches and the frames are rebuilt and written back automatically.
+class FrameCache:
+
+    MAGIC = b'KFC1'
+    VERSION = 1
+
+    def __init__(self, fi):
+        self.directory = os.path.join(fi.main_directory, '.cache', 'frames')
+
+    @staticmethod
+    def file_hash(path):
+        # Hash of a source file's contents. Used instead of mtimes so copies and checkouts stay valid.
+        sha = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def make_key(self, sources, sizes):
+        # Key used to validate a cache file. Built from the hash of every source file and the target sizes.
+        sha = hashlib.sha1()
+        sha.update(str(self.VERSION).encode())
+        for source in sources:
+            sha.update(os.path.basename(source).encode())
+            sha.update(self.file_hash(source).encode())
+        sha.update(repr(sizes).encode())
+        return sha.hexdigest()
+
+    def load(self, name, sources, sizes, build):
+
+        """ Returns the frames of the frame set called name as a list of frame lists.
+            sources are the files the frames are made from and sizes the target size(s) they are scaled to.
+            build is called to create the frames when the cache is missing or out of date. """
+
+        key = self.make_key(sources, sizes)
+        path = os.path.join(self.directory, name + '.bin')
+        groups = self.read(path, key)
+        if groups is None:
+            groups = build()
+            self.write(path, key, groups)
+        return groups
+
+    @staticmethod
+    def surface_entry(surface):
+        # Describes how a surface is stored. Per pixel alpha surfaces are stored as RGBA,
+        # all others as RGB with their colorkey restored on load.
+        alpha = bool(surface.get_flags() & pg.SRCALPHA)
+        colorkey = surface.get_colorkey()
+        return {'size': surface.get_size(),
+                'format': 'RGBA' if alpha else 'RGB',
+                'colorkey': None if alpha or colorkey is None else list(colorkey),
+                'rle': bool(surface.get_flags() & pg.RLEACCEL)}
+
+    @classmethod
+    def write_raw(cls, path, key, groups):
+        # Write a list of surface lists to path. Written to a temporary file first so that
+        # an interrupted write never leaves a half written cache behind.
+        entries = []
+        chunks = []
+        offset = 0
+        for group in groups:
+            group_entries = []
+            for surface in group:
+                entry = cls.surface_entry(surface)
+                data = pg.image.tobytes(surface, entry['format'])
+                entry['offset'] = offset
+                entry['length'] = len(data)
+                offset += len(data)
+                chunks.append(data)
+                group_entries.append(entry)
+            entries.append(group_entries)
+
+        header = json.dumps({'key': key, 'groups': entries}).encode()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(cls.MAGIC)
+            file.write(struct.pack('<I', len(header)))
+            file.write(header)
+            for data in chunks:
+                file.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def open_raw(cls, path, key):
+
+        """ Memory maps the cache file at path. Returns the map, the offset of the pixel data and the
+            surface entries, or None if the file is missing, damaged, or was made with a different key. """
+
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            return None
+        with file:
+            try:
+                mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file.
+                return None
+        try:
+            if mm[0:4] != cls.MAGIC:
+                raise ValueError
+            header_length = struct.unpack('<I', mm[4:8])[0]
+            header = json.loads(mm[8:8 + header_length].decode())
+            if header['key'] != key:
+                raise ValueError
+        except (ValueError, KeyError, struct.error):
+            mm.close()
+            return None
+        return mm, 8 + header_length, header['groups']
+
+    @staticmethod
+    def restore(view, entry):
+        # Create a display ready surface from a memory mapped entry. The converted copy no
+        # longer references the map.
+        raw = pg.image.frombuffer(view[entry['offset']:entry['offset'] + entry['length']],
+                                  tuple(entry['size']), entry['format'])
+        if entry['format'] == 'RGBA':
+            return raw.convert_alpha()
+        surface = raw.convert()
+        if entry['colorkey'] is not None:
+            surface.set_colorkey(entry['colorkey'], pg.RLEACCEL if entry['rle'] else 0)
+        return surface
+
+    def read(self, path, key):
+        opened = self.open_raw(path, key)
+        if opened is None:
+            return None
+        mm, data_offset, entries = opened
+        view = memoryview(mm)[data_offset:]
+        try:
+            groups = [[self.restore(view, entry) for entry in group] for group in entries]
+        except (ValueError, pg.error):
+            groups = None
+        view.release()
+        mm.close()
+        return groups
+
+    def write(self, path, key, groups):
+        try:
+            self.write_raw(path, key, groups)
+        except OSError:
+            # A read only install simply runs without the cache.
+            pass
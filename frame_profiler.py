@@ -0,0 +1,127 @@
+from collections import deque
+from time import perf_counter
+import pygame as pg
+from text_engine import text_engine
+
+
+# Phases of the game loop in the order they are shown.
+# Each sprite phase includes both the simulation steps and drawing of its group.
+PHASES = ['back', 'enemy', 'character', 'npc', 'particles', 'front', 'map', 'display']
+
+
+# Optional overlay timing every phase of the game loop.
+# Shows rolling min/avg/p99 times for each phase, the dirty rects sent to the display, the pixels merging them saved
+# and a frame time graph.
+# Toggled with toggle_key. Timing costs a single check per phase while the overlay is hidden.
+class FrameProfiler:
+    def __init__(self, font, budget_ms=1000 / 97, history=240, toggle_key=pg.K_F3):
+        self.enabled = False
+        self.toggle_key = toggle_key
+        self.key_down = False
+        # Set on the frame the overlay is hidden so its area is refreshed once more.
+        self.hidden = False
+        self.budget_ms = budget_ms
+        self.history = history
+        self.times = {phase: deque(maxlen=history) for phase in PHASES}
+        self.frame_times = deque(maxlen=history)
+        self.current = dict.fromkeys(PHASES, 0)
+        self.last = perf_counter()
+        self.frame_start = self.last
+        self.rect_count = 0
+        self.pixels = 0
+        self.saved = 0
+        # Stats are recalculated every stats_interval frames to keep the overlay itself cheap.
+        self.stats_interval = 15
+        self.frame = 0
+        self.stats = {}
+        self.text = text_engine.atlas(font, 18, (255, 255, 255))
+        self.rect = pg.Rect((10, 10), (480, 350))
+
+    def handle_keys(self, keys):
+        # Toggles the overlay on a press of toggle_key. Uses the key state as events are read by the maps and Fursa.
+        pressed = keys[self.toggle_key]
+        if pressed and not self.key_down:
+            self.enabled = not self.enabled
+            self.hidden = not self.enabled
+            for times in self.times.values():
+                times.clear()
+            self.frame_times.clear()
+            self.stats = {}
+            self.frame_start = perf_counter()
+        self.key_down = pressed
+
+    def begin(self):
+        # Called at the start of a frame once the frame cap has been waited out.
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.frame_times.append((now - self.frame_start) * 1000)
+        self.frame_start = self.last = now
+        self.current = dict.fromkeys(PHASES, 0)
+
+    def mark(self, phase):
+        # Adds the time since the previous mark to phase.
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def end(self, rect_count, pixels, saved=0):
+        # Called once the display was updated with the number of rects and pixels sent to it.
+        # saved is the number of pixels merging the dirty rects kept from being redrawn.
+        if not self.enabled:
+            return
+        for phase in PHASES:
+            self.times[phase].append(self.current[phase] * 1000)
+        self.rect_count = rect_count
+        self.pixels = pixels
+        self.saved = saved
+        self.frame += 1
+        if self.frame % self.stats_interval == 0 or not self.stats:
+            self.stats = {phase: self.summary(times) for phase, times in self.times.items()}
+            self.stats['frame'] = self.summary(self.frame_times)
+
+    @staticmethod
+    def summary(times):
+        # Min, average and 99th percentile of times.
+        if not times:
+            return 0, 0, 0
+        ordered = sorted(times)
+        return ordered[0], sum(ordered) / len(ordered), ordered[int(0.99 * (len(ordered) - 1))]
+
+    def draw(self, screen):
+
+        """ Draws the overlay. Returns the screen rects to refresh, which include the overlay
+            area on the frame after it was hidden. """
+
+        if not self.enabled:
+            if self.hidden:
+                self.hidden = False
+                return [self.rect]
+            return []
+
+        x, y = self.rect.topleft
+        screen.fill((0, 0, 0), self.rect)
+        items = []
+        for column, label in zip((10, 150, 260, 370), ('phase', 'min', 'avg', 'p99')):
+            items += self.text.blit_items(label, (x + column, y + 10))
+        for row, phase in enumerate(PHASES + ['frame']):
+            row_y = y + 35 + row * 22
+            items += self.text.blit_items(phase, (x + 10, row_y))
+            for column, value in zip((150, 260, 370), self.stats.get(phase, (0, 0, 0))):
+                items += self.text.blit_items('%.2f' % value, (x + column, row_y))
+        items += self.text.blit_items('rects %d  pixels %d  saved %d' % (self.rect_count, self.pixels, self.saved),
+                                      (x + 10, y + 35 + (len(PHASES) + 1) * 22))
+        screen.blits(items, doreturn=False)
+
+        # Frame time graph. Bars over the frame budget are red. Full height is twice the budget.
+        graph = pg.Rect((x + 10, self.rect.bottom - 90), (self.rect.width - 20, 80))
+        scale = graph.height / (self.budget_ms * 2)
+        bar_width = max(graph.width // self.history, 1)
+        for i, ms in enumerate(self.frame_times):
+            height = min(int(ms * scale), graph.height)
+            color = (200, 40, 40) if ms > self.budget_ms else (40, 200, 40)
+            screen.fill(color, (graph.x + i * bar_width, graph.bottom - height, bar_width, height))
+        screen.fill((255, 255, 255), (graph.x, graph.bottom - int(self.budget_ms * scale), graph.width, 1))
+        return [self.rect]
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+import pygame as pg
+
+
+# Cache of transformed copies of animation frame lists, such as left facing (flipped), scaled or tinted frames.
+# Each variant of a frame list is built once and shared by every sprite using that list.
+# Least recently used variants are evicted once the cached pixels exceed max_bytes.
+class FrameVariants:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.variants = OrderedDict()
+
+    def get(self, frames, variant, transform):
+
+        """ Returns frames with transform applied to every frame. variant names the transform.
+            The source list is kept with its variants so its id can not be reused while it is cached. """
+
+        key = (id(frames), variant)
+        entry = self.variants.get(key)
+        if entry is not None and entry[0] is frames:
+            self.variants.move_to_end(key)
+            return entry[1]
+
+        transformed = [transform(frame) for frame in frames]
+        size = sum(frame.get_bytesize() * frame.get_width() * frame.get_height() for frame in transformed)
+        self.variants[key] = (frames, transformed, size)
+        self.size += size
+        # Evict the least recently used variants. The newest is always kept.
+        while self.size > self.max_bytes and len(self.variants) > 1:
+            self.size -= self.variants.popitem(last=False)[1][2]
+        return transformed
+
+    def discard(self, frames):
+        # Drops every variant of frames along with the reference to them. Called when the sprites using them are
+        # unloaded, as a cached source list is otherwise kept alive until it is evicted.
+        for key in [key for key, entry in self.variants.items() if entry[0] is frames]:
+            self.size -= self.variants.pop(key)[2]
+
+    def flipped(self, frames):
+        # Frames mirrored horizontally. Used for sprites facing left.
+        return self.get(frames, ('flip',), lambda frame: pg.transform.flip(frame, True, False))
+
+    def scaled(self, frames, size):
+        return self.get(frames, ('scale', tuple(size)), lambda frame: pg.transform.scale(frame, size))
+
+    def tinted(self, frames, color):
+        # Frames with their colors multiplied by color. Used for hit flashes and status effects.
+        def tint(frame):
+            tinted_frame = frame.copy()
+            tinted_frame.fill(color, special_flags=pg.BLEND_RGB_MULT)
+            return tinted_frame
+        return self.get(frames, ('tint', tuple(color)), tint)
+
+
+# Shared by every sprite so that sprites using the same frames share their variants.
+frame_variants = FrameVariants()
@@ -1,5 +1,11 @@
 import pygame as pg
 from fursa_projectiles import SpiritBlast, BlastFrames
+from frame_cache import FrameCache
+from asset_loader import load_images
+from physics import sweep
+from frame_variants import frame_variants
+from game_input import game_input
+from combat_engine import fursa_stats
 
 
 # Fursa sprite. The main character of the game
@@ -20,8 +26,10 @@ class Fursa(pg.sprite.Sprite):
         fursa_projectile = BlastFrames(fi)
         self.projectile_frames = fursa_projectile.frames
 
-        # Sprite rect init.
+        # Sprite rect init. Hitbox and refresh rect are updated every step in update.
         self.rect = pg.Rect((200, 20), (128, 128))
+        self.hitbox_rect = pg.Rect((self.rect.x + 52, self.rect.y + 36), (18, 64))
+        self.refresh_rect = pg.Rect((self.rect.x - 64, self.rect.y - 64), (256, 256))
 
         # States.
         self.prev_state = 0
@@ -32,6 +40,7 @@ class Fursa(pg.sprite.Sprite):
         self.hit = False
         self.cutscene_enter = False
         self.map_forward = False
+        self.map_backward = False
         self.battle_forward = False
         self.walking = False
         self.running = False
@@ -59,15 +68,11 @@ class Fursa(pg.sprite.Sprite):
         # Character attributes and battle states.
         self.level = 1
         self.exp = 0
-        self.current_hp = 10
-        self.current_mp = 10
-        self.max_hp = 10
-        self.max_mp = 10
-        self.party_spawn = 2
-        self.speed = 3
+        # HP, MP, speed and moves used by the combat engine.
+        self.combatant = fursa_stats()
+        self.party_spawn = self.combatant.spawn
         self.spell = False
         self.turn = False
-        self.turn_determiner = [self.party_spawn, self.speed]
 
         # Combat move and selection descriptions.
         self.slot_labels = {1: ['ATTACK', 'SPIRIT BLAST'],
@@ -109,17 +114,32 @@ class Fursa(pg.sprite.Sprite):
         directories = ["Players Fursa Idle", "Players Fursa Walk", "Players Fursa Run",
                        "Players Fursa Attack_01", "Players Fursa Attack_02", "Players Fursa Death"]
 
-        # Create a list containing lists with all animation frames. Each list is referenceable by the state ID shown above.
-        for i, directory in enumerate(directories):
+        # Source files of every animation, in the same order as the state IDs above.
+        sources = []
+        for directory in directories:
             self.fi.cd(directory)
-            for img_file in self.fi.file_list():
-                self.all_frames[i].append(pg.transform.scale(pg.image.load(self.fi.path(img_file)).convert_alpha(), (128, 128)))
+            sources.append([self.fi.path(img_file) for img_file in self.fi.file_list()])
+
+        def build():
+            # Images are decoded in parallel by the asset loader, then converted and scaled on the main thread.
+            return [[pg.transform.scale(image.convert_alpha(), (128, 128)) for image in load_images(paths)]
+                    for paths in sources]
+
+        # Create a list containing lists with all animation frames. Each list is referenceable by the state ID shown above.
+        # Frames are read from the baked frame cache and only decoded and scaled when a source image has changed.
+        frames = FrameCache(self.fi).load('fursa', [path for paths in sources for path in paths], (128, 128), build)
+        for i, images in enumerate(frames):
+            self.all_frames[i].extend(images)
         # Hit animation is simply the first couple of frames from the death animation.
         self.all_frames[6] = (self.all_frames[5][0:7])
 
         # Create a list of number of frames for each animation. Used to know when frame_index should be reset.
         self.frame_maxes = [len(images) for images in self.all_frames]
 
+        # Build the left facing frames once so that turning around never flips frames in update.
+        for images in self.all_frames:
+            frame_variants.flipped(images)
+
     def change_state_keys(self):
 
         """ Function that changes Fursa's animation depending on keyboard input.
@@ -178,7 +198,7 @@ class Fursa(pg.sprite.Sprite):
         # Monitor held down keys. (movement)
         # If an attack animation is not in progress, move in the direction of the pressed key.
         if self.attack is False:
-            keys = pg.key.get_pressed()
+            keys = game_input.pressed()
             if keys[pg.K_d]:
                 self.rect.x += self.move
                 self.key_pressed = True
@@ -194,7 +214,7 @@ class Fursa(pg.sprite.Sprite):
                 self.move = 1 * dt
 
         # Pygame event loop.
-        for event in pg.event.get():
+        for event in game_input.events():
 
             # Monitor single key presses.
             # If a key is pressed and an attack animation is not in progress, register the key press.
@@ -224,6 +244,10 @@ class Fursa(pg.sprite.Sprite):
                     if self.rect.collidepoint(map.portal_rect.centerx, map.portal_rect.centery):
                         self.teleport_noise.play()
                         self.map_forward = True
+                    # Exits lead back to the previous map.
+                    elif map.exit_rect is not None and self.rect.colliderect(map.exit_rect):
+                        self.teleport_noise.play()
+                        self.map_backward = True
 
                 # Allow closing the game.
                 elif event.key == pg.K_ESCAPE:
@@ -289,7 +313,7 @@ class Fursa(pg.sprite.Sprite):
         self.prev_state = self.state
 
         # If it is Fursa's turn, allow action.
-        if map.current_turn == self.party_spawn:
+        if map.current_turn is self.combatant:
             # Melee attack.
             if map.battle_command == 1:
                 map.animation_complete = False
@@ -328,6 +352,15 @@ class Fursa(pg.sprite.Sprite):
         if self.prev_state != self.state:
             self.frame_index = 0
 
+    def leave_battle(self):
+        # Back to idle in the open world once a battle is over.
+        self.attack = self.spell = self.hit = self.jump = False
+        self.key_pressed = False
+        self.facing_right = True
+        self.fall_rate = 1
+        self.change_state_battle(0)
+        self.frame_index = 0
+
     def update(self, time, dt, map, screen, sprites, file):
 
         """ Main update function. Continuously called at all times in game loop main()
@@ -389,7 +422,7 @@ class Fursa(pg.sprite.Sprite):
                 self.frame_index += 1
                 self.frame_override = True
             else:
-                self.image = pg.transform.flip(self.current_frames[self.frame_index], True, False)
+                self.image = frame_variants.flipped(self.current_frames)[self.frame_index]
                 self.frame_index += 1
                 self.frame_override = False
 
@@ -418,13 +451,8 @@ class Fursa(pg.sprite.Sprite):
                     sprites['particles'].add(blast)
 
         # Gravity emulation using map platforms.
-        for block in map.blockers:
-            # Checks to see if Fursa is in contact with the ground.
-            if self.hitbox_rect.colliderect(block):
-                self.on_ground = True
-                break
-            else:
-                self.on_ground = False
+        # Checks to see if Fursa is in contact with the ground. Only nearby blockers are tested.
+        self.on_ground = map.blocker_index.collides(self.hitbox_rect)
 
         if self.on_ground is False:
             # If not in contact with the ground, accelerates falling down every 20 ms by 10%.
@@ -432,18 +460,11 @@ class Fursa(pg.sprite.Sprite):
             if (time - self.gravity_dt) >= 20 and self.jump is False:
                 self.gravity_dt = time
                 self.fall_rate *= 1.1
-                start_fall = self.rect.y
-                for i in range(int(self.fall_rate)):
-                    self.rect.y += 1
-                    self.hitbox_rect.y += 1
-                    end_fall = self.rect.y
-                    if (end_fall - start_fall) > 256:
-                        pg.display.update(self.refresh_rect)
-                    # Halts falling when Fursa lands on a block.
-                    for block in map.blockers:
-                        if self.hitbox_rect.colliderect(block):
-                            self.fall_rate = 1
-                            self.on_ground = True
-                            break
-                    if self.on_ground is True:
-                        break
+                # The whole fall is resolved in one step against the blockers.
+                fall, landed = sweep(self.hitbox_rect, int(self.fall_rate), map.blocker_index)
+                self.rect.y += fall
+                self.hitbox_rect.y += fall
+                # Halts falling when Fursa lands on a block.
+                if landed:
+                    self.fall_rate = 1
+                    self.on_ground = True
@@ -1,4 +1,6 @@
 from spritesheet import SpriteSheet
+from frame_cache import FrameCache
+from frame_variants import frame_variants
 import pygame as pg
 
 
@@ -10,20 +12,21 @@ class BlastFrames:
 
     def __init__(self, fi):
         self.fi = fi
-        # Fursa's attack blast properly separated into frames into a list from a spritesheet.
         self.fi.cd("Players Fursa")
-        coordinates = [(128 * i, 0, 128, 128) for i in range(0, 8)]
-        blast_image_ss = SpriteSheet(self.fi.path('EnergyBall.png'))
-        blast_images_separate = blast_image_ss.images_at(coordinates, colorkey=(0, 0, 0))
-        self.blast_frames_r = [pg.transform.scale(blast_images_separate[i], (64, 64)) for i in range(0, len(blast_images_separate))]
-        self.blast_frames_l = [pg.transform.flip(self.blast_frames_r[i], True, False) for i in range(0, len(self.blast_frames_r))]
-
-        # Impact frames.
-        coordinates = [(0, 128 * i, 128, 128) for i in range(0, 8)]
-        impact_images_ss = SpriteSheet(self.fi.path('energyBallImpact.png'))
-        impact_images_separate = impact_images_ss.images_at(coordinates, colorkey=(0, 0, 0))
-        self.impact_frames_r = [pg.transform.scale(impact_images_separate[i], (64, 64)) for i in range(0, len(impact_images_separate))]
-        self.impact_frames_l = [pg.transform.flip(self.impact_frames_r[i], True, False) for i in range(0, len(self.impact_frames_r))]
+        # Fursa's attack blast and impact spritesheets.
+        sources = [self.fi.path('EnergyBall.png'), self.fi.path('energyBallImpact.png')]
+        coordinates = [[(128 * i, 0, 128, 128) for i in range(0, 8)],
+                       [(0, 128 * i, 128, 128) for i in range(0, 8)]]
+
+        def build():
+            # Frames properly separated into lists from the spritesheets.
+            separate = [SpriteSheet(path).images_at(coordinates[i], colorkey=(0, 0, 0)) for i, path in enumerate(sources)]
+            return [[pg.transform.scale(frame, (64, 64)) for frame in frames] for frames in separate]
+
+        # Scaled frames are read from the baked frame cache and only rebuilt when a spritesheet has changed.
+        self.blast_frames_r, self.impact_frames_r = FrameCache(self.fi).load('spirit_blast', sources, [coordinates, (64, 64)], build)
+        self.blast_frames_l = frame_variants.flipped(self.blast_frames_r)
+        self.impact_frames_l = frame_variants.flipped(self.impact_frames_r)
 
         self.frames = [self.blast_frames_r, self.blast_frames_l, self.impact_frames_r, self.impact_frames_l]
 
@@ -50,6 +53,10 @@ class SpiritBlast(pg.sprite.Sprite):
             self.frames = self.blast_frames_l
             self.impact = self.impact_frames_l
 
+        # Hitbox and refresh rect are updated every step in update.
+        self.refresh_rect = pg.Rect((self.rect.x - 16, self.rect.y - 16), (96, 96))
+        self.hitbox_rect = pg.Rect((self.rect.x + 10, self.rect.y + 20), (48, 20))
+
         # Initialize frame parameters.
         self.image = self.frames[0]
         self.i = 0
@@ -0,0 +1,253 @@
+from collections import deque
+import gzip
+import struct
+import pygame as pg
+
+
+# Keyboard and mouse input of the game.
+# Every part of the game reads events and held keys through game_input instead of from pygame directly,
+# so the input can be replaced by a script for benchmarks, or recorded and replayed.
+class GameInput:
+    def __init__(self):
+        # Input source. The keyboard and mouse are used when None.
+        self.source = None
+
+    def use(self, source):
+        self.source = source
+
+    def events(self):
+        # Replaces pg.event.get(). Returns the events since the last call.
+        if self.source is None:
+            return pg.event.get()
+        return self.source.events()
+
+    def pressed(self):
+        # Replaces pg.key.get_pressed().
+        if self.source is None:
+            return pg.key.get_pressed()
+        return self.source.pressed()
+
+    def tick(self, frame_ms):
+        # Called at the start of every frame with the real frame time. Returns the frame time to simulate.
+        if self.source is None:
+            return frame_ms
+        return self.source.tick(frame_ms)
+
+    @property
+    def finished(self):
+        # True once a replay has run out of recorded frames.
+        return self.source is not None and self.source.finished
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+
+# Base of the input sources. Reads the keyboard and mouse.
+class InputSource:
+    finished = False
+
+    def events(self):
+        return pg.event.get()
+
+    def pressed(self):
+        return pg.key.get_pressed()
+
+    def tick(self, frame_ms):
+        return frame_ms
+
+    def close(self):
+        pass
+
+
+# Held key state of scripted input. Indexed by key like the result of pg.key.get_pressed().
+class ScriptedKeys:
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+# Input driven by a script instead of the keyboard and mouse.
+# Events are queued by the script and handed to the game on the next events() call.
+class ScriptedInput(InputSource):
+    def __init__(self):
+        self.queue = []
+        self.held = set()
+
+    def press(self, key):
+        # Hold down key until it is released.
+        if key not in self.held:
+            self.held.add(key)
+            self.queue.append(pg.event.Event(pg.KEYDOWN, key=key))
+
+    def release(self, key):
+        if key in self.held:
+            self.held.discard(key)
+            self.queue.append(pg.event.Event(pg.KEYUP, key=key))
+
+    def hold(self, keys):
+        # Hold exactly the given keys.
+        for key in list(self.held):
+            if key not in keys:
+                self.release(key)
+        for key in keys:
+            self.press(key)
+
+    def tap(self, key):
+        # Press and release key within a single frame.
+        self.queue.append(pg.event.Event(pg.KEYDOWN, key=key))
+        self.queue.append(pg.event.Event(pg.KEYUP, key=key))
+
+    def click(self, pos=(0, 0)):
+        self.queue.append(pg.event.Event(pg.MOUSEBUTTONDOWN, button=1, pos=pos))
+
+    def events(self):
+        # Events from the display are dropped so the queue does not fill up.
+        pg.event.get()
+        events = self.queue
+        self.queue = []
+        return events
+
+    def pressed(self):
+        return ScriptedKeys(self.held)
+
+
+# Input recordings are a gzip compressed stream starting with MAGIC, followed by a record for every frame and for
+# every call to events() and pressed(), in the order the game made them:
+#   FRAME    frame time in ms as a double, exactly as the recorded session simulated it
+#   EVENTS   event count, then the index in EVENT_TYPES and the attributes of each event
+#   PRESSED  count of scancodes whose state changed since the previous PRESSED record, then the scancodes
+# Replaying the records gives the simulation the same frame times and input, so it plays out frame for frame.
+MAGIC = b'KIR2'
+FRAME = b'F'
+EVENTS = b'E'
+PRESSED = b'P'
+EVENT_TYPES = [pg.KEYDOWN, pg.KEYUP, pg.MOUSEBUTTONDOWN, pg.QUIT]
+# Length of pg.key.get_pressed().
+SCANCODES = 512
+
+
+def encode_events(events):
+    data = []
+    for event in events:
+        if event.type not in EVENT_TYPES:
+            continue
+        index = EVENT_TYPES.index(event.type)
+        if event.type in (pg.KEYDOWN, pg.KEYUP):
+            data.append(struct.pack('<BiH', index, event.key, getattr(event, 'mod', 0) & 0xffff))
+        elif event.type == pg.MOUSEBUTTONDOWN:
+            data.append(struct.pack('<BBhh', index, event.button, event.pos[0], event.pos[1]))
+        else:
+            data.append(struct.pack('<B', index))
+    return EVENTS + struct.pack('<H', len(data)) + b''.join(data)
+
+
+def decode_events(data, offset):
+    # Returns the events of an EVENTS record starting after its tag, and the offset after the record.
+    count, = struct.unpack_from('<H', data, offset)
+    offset += 2
+    events = []
+    for i in range(count):
+        event_type = EVENT_TYPES[data[offset]]
+        if event_type in (pg.KEYDOWN, pg.KEYUP):
+            index, key, mod = struct.unpack_from('<BiH', data, offset)
+            events.append(pg.event.Event(event_type, key=key, mod=mod))
+            offset += 7
+        elif event_type == pg.MOUSEBUTTONDOWN:
+            index, button, x, y = struct.unpack_from('<BBhh', data, offset)
+            events.append(pg.event.Event(event_type, button=button, pos=(x, y)))
+            offset += 6
+        else:
+            events.append(pg.event.Event(event_type))
+            offset += 1
+    return events, offset
+
+
+# Plays the game with the keyboard and mouse and records every frame time and input to a file.
+class InputRecorder(InputSource):
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wb')
+        self.file.write(MAGIC)
+        self.held = frozenset()
+
+    def tick(self, frame_ms):
+        self.file.write(FRAME + struct.pack('<d', frame_ms))
+        return frame_ms
+
+    def events(self):
+        events = pg.event.get()
+        self.file.write(encode_events(events))
+        return events
+
+    def pressed(self):
+        keys = pg.key.get_pressed()
+        held = frozenset(scancode for scancode, down in enumerate(keys) if down)
+        changed = sorted(held ^ self.held)
+        self.held = held
+        self.file.write(PRESSED + struct.pack('<H%dH' % len(changed), len(changed), *changed))
+        return keys
+
+    def close(self):
+        self.file.close()
+
+
+# Feeds the frame times and input of a recording back to the game. Live input is ignored.
+class InputReplay(InputSource):
+    def __init__(self, path):
+        with gzip.open(path, 'rb') as file:
+            data = file.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not an input recording' % path)
+
+        # Frame time, event lists and held keys of every frame, in the order they were read.
+        self.frames = []
+        held = [False] * SCANCODES
+        offset = len(MAGIC)
+        while offset < len(data):
+            tag = data[offset:offset + 1]
+            offset += 1
+            if tag == FRAME:
+                frame_ms, = struct.unpack_from('<d', data, offset)
+                offset += 8
+                self.frames.append((frame_ms, [], []))
+            elif tag == EVENTS:
+                events, offset = decode_events(data, offset)
+                self.frames[-1][1].append(events)
+            elif tag == PRESSED:
+                count, = struct.unpack_from('<H', data, offset)
+                for scancode in struct.unpack_from('<%dH' % count, data, offset + 2):
+                    held[scancode] = not held[scancode]
+                offset += 2 + 2 * count
+                self.frames[-1][2].append(pg.key.ScancodeWrapper(held))
+            else:
+                raise ValueError('%s is corrupt at byte %d' % (path, offset - 1))
+
+        self.index = 0
+        self.finished = False
+        self.event_calls = deque()
+        self.pressed_calls = deque()
+        self.keys = pg.key.ScancodeWrapper([False] * SCANCODES)
+
+    def tick(self, frame_ms):
+        if self.index == len(self.frames):
+            self.finished = True
+            return 0
+        frame_ms, events, pressed = self.frames[self.index]
+        self.index += 1
+        self.event_calls = deque(events)
+        self.pressed_calls = deque(pressed)
+        return frame_ms
+
+    def events(self):
+        pg.event.get()
+        return self.event_calls.popleft() if self.event_calls else []
+
+    def pressed(self):
+        if self.pressed_calls:
+            self.keys = self.pressed_calls.popleft()
+        return self.keys
+
+
+game_input = GameInput()
@@ -1,7 +1,16 @@
 import pygame as pg
 import pygame.freetype
 import os
+import argparse
 from spritesheet import SpriteSheet
+from frame_cache import FrameCache
+from asset_loader import AssetLoader
+from timestep import FixedTimestep, store_positions, interpolate
+from dirty_rects import DirtyRegions
+from text_engine import text_engine
+from frame_profiler import FrameProfiler
+from game_input import game_input, InputRecorder, InputReplay
+from map_registry import MapRegistry
 
 # Import Game Modules
 from fursa import Fursa
@@ -39,7 +48,24 @@ class FileNavigator:
         return self.current_directory + '/' + file_name
 
 
-def main():
+# Most frames rendered per second. Simulation runs at a fixed rate independent of it.
+RENDER_FPS = 97
+
+# Maps in the order they are travelled through. Portals lead to the next map and exits back to the previous one.
+ROUTE = ['Starting_Area', 'Tutorial_Area']
+# Memory the graphics of the cached maps may take up before the least recently used ones are unloaded.
+MAP_MEMORY = 256 * 1024 * 1024
+
+
+def main(driver=None, fast_forward=None):
+
+    """ Runs the game. driver is used by scripted runs such as benchmarks.
+        driver.frame(current_map, sprites) is called at the start of every frame and ends the game by returning False.
+        If driver.frame_ms is not None, every frame simulates frame_ms of game time and rendering is not capped,
+        which makes the run independent of how fast frames are rendered.
+        fast_forward runs the game as fast as it can be simulated for soak tests and replays. Every frame simulates
+        a frame at RENDER_FPS, only every fast_forward-th frame is drawn (none for 0) and waits are not slept. """
+
     fi = FileNavigator()
     # Initiate pygame parameters.
     pg.mixer.pre_init(44100, -16, 2, 1024)
@@ -53,57 +79,52 @@ def main():
     clock = pg.time.Clock()
 
     """ Loads many graphical parameters here so that all data can be initialized once,
-        cached, and reused by all classes. """
+        cached, and reused by all classes.
+        Independent image, sound and font files are decoded in parallel by the asset loader.
+        Conversion and scaling, which need the display, are done on the main thread in loader.results(). """
+
+    loader = AssetLoader()
 
     # Dialog Initialization.
     fi.cd('UI Dialog')
-    dialog_box = pg.image.load(fi.path('dialogue_box.png')).convert_alpha()
-    dialog_box = pg.transform.scale(dialog_box, (795, 195))
-    dialog_font = pg.freetype.Font(fi.path('eight-bit-dragon.otf'), size=24)
-    dialog_noise = pg.mixer.Sound(fi.path('chat_noise.wav'))
+    loader.image('dialogBox', fi.path('dialogue_box.png'), size=(795, 195))
+    loader.font('dialogFont', fi.path('eight-bit-dragon.otf'), size=24)
+    loader.sound('dialogNoise', fi.path('chat_noise.wav'))
 
     # User interface boxes. There is a combat, status, and description box.
     fi.cd('UI Combat')
-    base_box = pg.image.load(fi.path('Combat UI Box transparent.png')).convert_alpha()
-    status_box = pg.transform.scale(base_box, (670, 300))
-    combat_box = pg.transform.scale(base_box, (690, 300))
-    description_box = pg.transform.scale(base_box, (460, 300))
+    loader.image('baseBox', fi.path('Combat UI Box transparent.png'))
     # Pointer indicating whose turn it is during a battle.
-    pointer = pg.image.load(fi.path('black_triangle.png')).convert_alpha()
-    pointer = pg.transform.scale(pointer, (60, 42))
-    battle_sword_aftersound = pg.mixer.Sound(fi.path('battle_sword_aftersound.wav'))
-    battle_impact_noise = pg.mixer.Sound(fi.path('battle_start.wav'))
+    loader.image('pointer', fi.path('black_triangle.png'), size=(60, 42))
+    loader.sound('battleSwordAftersound', fi.path('battle_sword_aftersound.wav'))
+    loader.sound('battleImpactNoise', fi.path('battle_start.wav'))
     fi.cd('UI Fonts')
-    combat_font = pg.freetype.Font(fi.path('ferrum.otf'), size=24)
-    hpmp_font = pg.freetype.Font(fi.path('DisposableDroidBB_ital.ttf'), size=24)
-    fps_font = pg.freetype.Font(fi.path('digital-7.ttf'), size=48)
+    loader.font('combatFont', fi.path('ferrum.otf'), size=24)
+    loader.font('hpmpFont', fi.path('DisposableDroidBB_ital.ttf'), size=24)
+    loader.font('fpsFont', fi.path('digital-7.ttf'), size=48)
 
     # Portal animation.
     fi.cd('Maps')
+    loader.sound('portalBlast', fi.path('portal_noise.wav'))
+    # The portal aura sound is not in the repository yet.
+    loader.sound('portalAura', fi.path('portal_aura_noise.wav'), optional=True)
     coordinates = []
     for i in range(0, 7):
         coordinates.extend([(100 * e, 100 * i, 100, 100) for e in range(0, 8)])
     coordinates.extend([(100 * e, 700, 100, 100) for e in range(0, 5)])
-    portal_images_ss = SpriteSheet(fi.path('12_nebula_spritesheet.png'))
-    portal_images_separate = portal_images_ss.images_at(coordinates, colorkey=(0, 0, 0))
-    portal_images = [pg.transform.scale(portal_images_separate[i], (160, 160))
-                     for i in range(0, len(portal_images_separate))]
-    portal_blast = pg.mixer.Sound(fi.path('portal_noise.wav'))
-    portal_aura = pg.mixer.Sound(fi.path('portal_aura_noise.wav'))
-
-    package = {"dialogBox": dialog_box,
-               "dialogFont": dialog_font,
-               "dialogNoise": dialog_noise,
-               "statusBox": status_box,
-               "combatBox": combat_box,
-               "descriptionBox": description_box,
-               "pointer": pointer,
-               "combatFont": combat_font,
-               "hpmpFont": hpmp_font,
-               "battleNoises": [battle_sword_aftersound, battle_impact_noise],
-               "portal": [portal_images, portal_blast, portal_aura]}
-
-    """ Sprite group initialization done below. """
+    portal_source = fi.path('12_nebula_spritesheet.png')
+
+    def build_portal():
+        portal_images_ss = SpriteSheet(portal_source)
+        portal_images_separate = portal_images_ss.images_at(coordinates, colorkey=(0, 0, 0))
+        return [[pg.transform.scale(portal_images_separate[i], (160, 160))
+                 for i in range(0, len(portal_images_separate))]]
+
+    # Scaled portal frames are read from the baked frame cache and only rebuilt when the spritesheet changes.
+    portal_images = FrameCache(fi).load('portal', [portal_source], [coordinates, (160, 160)], build_portal)[0]
+
+    """ Sprite group initialization done below.
+        Done while the asset loader is still decoding the files queued above. """
 
     fursa = Fursa(fi)
     character_sprites = pg.sprite.GroupSingle()
@@ -119,19 +140,48 @@ def main():
                "enemy": enemy_sprites,
                "particles": particle_sprites}
 
+    assets = loader.results()
+    base_box = assets['baseBox']
+    fps_text = text_engine.atlas(assets['fpsFont'])
+    # Fixed rate simulation clock. dt is the movement of one step.
+    timestep = FixedTimestep(realtime=fast_forward is None)
+
+    package = {"dialogBox": assets['dialogBox'],
+               "dialogFont": assets['dialogFont'],
+               "dialogNoise": assets['dialogNoise'],
+               "statusBox": pg.transform.scale(base_box, (670, 300)),
+               "combatBox": pg.transform.scale(base_box, (690, 300)),
+               "descriptionBox": pg.transform.scale(base_box, (460, 300)),
+               "pointer": assets['pointer'],
+               "combatFont": assets['combatFont'],
+               "hpmpFont": assets['hpmpFont'],
+               "battleNoises": [assets['battleSwordAftersound'], assets['battleImpactNoise']],
+               "portal": [portal_images, assets['portalBlast'], assets['portalAura']],
+               "timestep": timestep}
+
+    # Maps are built when first entered and cached by name.
+    maps = MapRegistry(MAP_MEMORY)
+    maps.register('Starting_Area', lambda assets: Map01(package, sprites, fi))
+    maps.register('Tutorial_Area', lambda assets: Map02(package, sprites, enemy_images, fi, assets),
+                  lambda: Map02.asset_paths(fi), Map02.load_assets, Map02.prepare_assets)
+
     # Declare Initial Map.
     # Test
-    # current_map = Tutorial_Area = Map02(package, sprites, enemy_images, fi)
+    # route_index = 1
 
     #Normal
-    Starting_Area = Map01(package, sprites, fi)
-    current_map = Starting_Area
+    route_index = 0
+    current_map = maps.switch(ROUTE[route_index], sprites)
 
     # Declare internal variables.
-    map_index = 0
     black = (0, 0, 0)
+    dt = 1
     old_rects = [pg.Rect((0, 0), (0, 0))]
+    dirty_regions = DirtyRegions(screen.get_rect())
     fps_rect = [pg.Rect((1860, 10), (50, 50))]
+    # Per phase timing overlay, toggled with F3.
+    profiler = FrameProfiler(assets['dialogFont'], 1000 / RENDER_FPS)
+    frame_count = 0
     running = True
 
     # Game Loop
@@ -139,63 +189,158 @@ def main():
 
         pg.event.pump()
 
-        # Get time between frames. Set fpx max to 97.
-        time = pg.time.get_ticks()
-        dt = clock.tick(97)
-        dt = round(dt / 11)
+        """ Handle transitioning to and from different maps.
+        
+            Route Index ------------------ Map ----------------Combat_Area(Y/N)------------
+           |   00                      Starting_Area                   N              |
+           |   01                      Tutorial_Area                   Y              |
+         ------------------------------------------------------------------------------ """
+
+        # Maps change at the start of the frame after the one that asked for it, so frames that are not drawn
+        # while fast forwarding change maps too.
+
+        # Prepare the next map in the background as soon as the portal to it opens.
+        if current_map.portal_start and route_index + 1 < len(ROUTE):
+            maps.prefetch(ROUTE[route_index + 1])
+
+        if fursa.map_forward or fursa.map_backward:
+            step = 1 if fursa.map_forward else -1
+            if 0 <= route_index + step < len(ROUTE):
+                # Leaves the old map and spawns Fursa appropriately in the new one.
+                route_index += step
+                current_map = maps.switch(ROUTE[route_index], sprites)
+                spawn = current_map.spawn if step == 1 else current_map.return_spawn
+                if spawn is not None:
+                    fursa.rect.x, fursa.rect.y = spawn
+            fursa.map_forward = False
+            fursa.map_backward = False
+
+        if fursa.battle_forward is True:
+            current_map.map_first_time = True
+            fursa.battle_forward = False
+
+        if driver is not None and driver.frame(current_map, sprites) is False:
+            break
+
+        # Run the simulation at a fixed rate, catching up on missed steps up to a cap.
+        # Rendering is capped at RENDER_FPS and can be changed without changing gameplay.
+        # A replayed session simulates the recorded frame times instead of the real ones.
+        # Time slept in pauses is not simulated.
+        waited = timestep.take_waited()
+        if driver is not None and driver.frame_ms is not None:
+            clock.tick()
+            frame_ms = driver.frame_ms
+        else:
+            if fast_forward is None:
+                frame_ms = max(clock.tick(RENDER_FPS) - waited, 0)
+            else:
+                clock.tick()
+                frame_ms = 1000 / RENDER_FPS
+            frame_ms = game_input.tick(frame_ms)
+            if game_input.finished:
+                break
+        frame_count += 1
+        steps = timestep.advance(frame_ms)
+        profiler.handle_keys(game_input.pressed())
+        profiler.begin()
+        for step in range(steps):
+            store_positions(sprites.values())
+            time = timestep.step()
+            enemy_sprites.update(time, dt, current_map, fursa, particle_sprites)
+            profiler.mark('enemy')
+            character_sprites.update(time, dt, current_map, screen, sprites, fi)
+            profiler.mark('character')
+            npc_sprites.update(time, dt, current_map)
+            profiler.mark('npc')
+            particle_sprites.update(dt, enemy_sprites)
+            profiler.mark('particles')
+            current_map.step()
+            profiler.mark('map')
+        # Sprites are drawn between their last two steps.
+        alpha = timestep.alpha
+
+        # Scroll the camera with Fursa. Sprites are drawn relative to the camera.
+        camera = current_map.camera
+        camera.follow(interpolate(fursa, alpha))
+
+        # Frames skipped while fast forwarding still run the map logic. The next drawn frame redraws everything.
+        if fast_forward is not None and (fast_forward == 0 or frame_count % fast_forward):
+            current_map.redrawn_rects = []
+            current_map.frame_drawn = False
+            current_map.update(fursa, sprites, screen)
+            current_map.map_first_time = True
+            continue
+        current_map.frame_drawn = True
+
+        # When the camera moved, the last frame is scrolled along with it and only the strips of the map it uncovered
+        # are drawn on top of what changed. The whole screen is still sent to the display.
+        # Parallax layers scroll at their own speed and cutscenes and battles keep boxes fixed on the screen,
+        # so everything is redrawn then instead.
+        full_redraw = current_map.map_first_time
+        scrolled = False
+        if camera.moved and not full_redraw:
+            if (camera.can_scroll(screen) and not current_map.map.parallax_layers and not current_map.cutscene and
+                    not current_map.battle):
+                active_rects = dirty_regions.merge(camera.scroll(screen, active_rects))
+                full_redraw = dirty_regions.full
+                scrolled = True
+            else:
+                full_redraw = True
 
         # Surfaces are blit and updated in order of back to front on screen.
 
         # Layer 1: Screen background back surface refresh.
 
-        if current_map.map_first_time:
-            screen.blit(current_map.map.back_surface, (0, 0))
+        if full_redraw:
+            current_map.map.draw_back(screen, camera)
         else:
-            for rect in active_rects:
-                screen.blit(current_map.map.back_surface, rect, rect)
+            current_map.map.draw_back(screen, camera, active_rects)
+        profiler.mark('back')
 
-        # Layer 2: Enemy sprites update.
+        # Layer 2: Enemy sprites.
 
-        enemy_sprites.update(time, dt, current_map, fursa, particle_sprites)
         # for enemy in enemy_sprites:
         #     pg.draw.rect(screen, black, enemy.hitbox_rect)
-        enemy_sprites.draw(screen)
-        enemy_rects = [enemy.refresh_rect for enemy in enemy_sprites.sprites()]
+        camera.draw(screen, enemy_sprites, alpha)
+        enemy_rects = [camera.apply(enemy.refresh_rect) for enemy in enemy_sprites.sprites()]
+        profiler.mark('enemy')
 
-        # Layer 3: Character sprites update.
+        # Layer 3: Character sprites.
 
-        character_sprites.update(time, dt, current_map, screen, sprites, fi)
         # pg.draw.rect(screen, black, fursa.refresh_rect)
-        character_sprites.draw(screen)
-        character_rects = [fursa.refresh_rect]
+        camera.draw(screen, character_sprites, alpha)
+        character_rects = [camera.apply(fursa.refresh_rect)]
+        profiler.mark('character')
 
-        # Layer 4: NPC sprites update.
+        # Layer 4: NPC sprites. Refresh rect covers the positions interpolated between.
 
-        npc_sprites.update(time, dt, current_map)
-        npc_sprites.draw(screen)
-        npc_rects = [npc.rect for npc in npc_sprites.sprites()]
+        camera.draw(screen, npc_sprites, alpha)
+        npc_rects = [camera.apply(npc.rect.inflate(4, 4)) for npc in npc_sprites.sprites()]
+        profiler.mark('npc')
 
-        # Layer 5: Particle sprites update.
+        # Layer 5: Particle sprites.
 
-        particle_sprites.update(dt, enemy_sprites)
         # for particle in particle_sprites:
         #     pg.draw.rect(screen, black, particle.hitbox_rect)
-        particle_sprites.draw(screen)
-        particle_rects = [particle.refresh_rect for particle in particle_sprites.sprites()]
+        camera.draw(screen, particle_sprites, alpha)
+        particle_rects = [camera.apply(particle.refresh_rect) for particle in particle_sprites.sprites()]
+        profiler.mark('particles')
 
         # Layer 6: Screen background front surface refresh.
 
-        if current_map.map_first_time:
-            screen.blit(current_map.map.front_surface, (0, 0))
+        if full_redraw:
+            current_map.map.draw_front(screen, camera)
         else:
-            for rect in active_rects:
-                screen.blit(current_map.map.front_surface, rect, rect)
+            current_map.map.draw_front(screen, camera, active_rects)
+        profiler.mark('front')
 
         # Layer 7: Cutscene animations and fps.
 
+        current_map.redrawn_rects = None if full_redraw else active_rects
         current_map.update(fursa, sprites, screen)
-        fps_text, rect = fps_font.render(str(int(round(clock.get_fps()))))
-        screen.blit(fps_text, (1860, 10))
+        fps_text.draw(screen, str(int(round(clock.get_fps()))), (1860, 10))
+        profiler_rects = profiler.draw(screen)
+        profiler.mark('map')
 
         #TEST
         # if current_map.map_first_time:
@@ -204,40 +349,45 @@ def main():
         #     for rect in current_map.refresh_rects:
         #         pg.draw.rect(screen, black, rect)
 
-        rects = character_rects + particle_rects + npc_rects + enemy_rects + fps_rect + current_map.refresh_rects
-        active_rects = rects + old_rects + current_map.ui
+        # Rects changed this frame and last frame are merged into as few non-overlapping rects as possible.
+        # They are refreshed next frame and sent to the display now.
+        rects = (character_rects + particle_rects + npc_rects + enemy_rects + fps_rect + current_map.refresh_rects +
+                 profiler_rects)
+        active_rects = dirty_regions.merge(rects + old_rects + current_map.ui)
 
-        if current_map.map_first_time:
+        if full_redraw or scrolled or dirty_regions.full:
             pg.display.flip()
+            profiler.mark('display')
+            profiler.end(1, screen.get_width() * screen.get_height())
         else:
             pg.display.update(active_rects)
+            profiler.mark('display')
+            profiler.end(dirty_regions.count, dirty_regions.area, dirty_regions.saved_area)
 
         old_rects = rects
         current_map.map_first_time = False
 
-        """ Handle transitioning to and from different maps.
-        
-            Map Index -------------------- Map ----------------Combat_Area(Y/N)------------
-           |   00                      Starting_Area                   N              |
-           |   01                      Tutorial_Area                   Y              |
-         ------------------------------------------------------------------------------ """
-
-        if fursa.map_forward is True:
-            # Cancel any and all sounds in previous map upon exit. (such as portal noise)
-            for sound in current_map.end_sounds:
-                sound.stop()
-            map_index += 1
-            if map_index == 1:
-                # Initializes new map and spawns Fursa appropriately.
-                current_map = Tutorial_Area = Map02(package, sprites, enemy_images, fi)
-                fursa.rect.x = current_map.spawnx
-                fursa.rect.y = current_map.spawny
-            fursa.map_forward = False
 
-        if fursa.battle_forward is True:
-            current_map.map_first_time = True
-            fursa.battle_forward = False
+def frame_interval(value):
+    # Argument type of --fast-forward.
+    interval = int(value)
+    if interval < 0:
+        raise argparse.ArgumentTypeError('must be 0 or more')
+    return interval
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Kismet')
+    parser.add_argument('--record', metavar='FILE', help='record the input of this session to FILE')
+    parser.add_argument('--replay', metavar='FILE', help='replay a session recorded with --record')
+    parser.add_argument('--fast-forward', metavar='N', type=frame_interval,
+                        help='simulate as fast as possible, drawing only every Nth frame (none for 0)')
+    options = parser.parse_args()
+    if options.record:
+        game_input.use(InputRecorder(options.record))
+    elif options.replay:
+        game_input.use(InputReplay(options.replay))
+    try:
+        main(fast_forward=options.fast_forward)
+    finally:
+        game_input.close()
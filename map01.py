@@ -1,7 +1,10 @@
 import pygame as pg
 from TiledMap import TiledMap
+from frame_cache import FrameCache
 from npc import Masir_sprite
 from base_map import BaseMap
+from game_input import game_input
+from frame_variants import frame_variants
 
 
 # Starting area.
@@ -12,11 +15,15 @@ class Map01(BaseMap):
 
         # Map graphics and music.
         self.fi.cd('Maps Map_01')
-        self.map = TiledMap(self.fi.path('Map_01_1920x1080.tmx'))
+        self.map = TiledMap(self.fi.path('Map_01_1920x1080.tmx'), cache=FrameCache(self.fi))
         self.map.make_map()
         self.blockers = self.map.blockers
-        self.music = pg.mixer.music.load(self.fi.path('296 - The Tea Garden (Loop).mp3'))
-        pg.mixer.music.play(loops=-1, start=0.0)
+        self.blocker_index = self.map.blocker_index
+        self.camera.set_bounds(self.map.width, self.map.height)
+        self.music_path = self.fi.path('296 - The Tea Garden (Loop).mp3')
+
+        # Fursa returns from the next map through the portal.
+        self.return_spawn = (self.portal_rect.centerx - 64, self.portal_rect.y)
 
         # Declare npcs.
         self.Masir = Masir_sprite(800, 600, self.fi)
@@ -56,7 +63,7 @@ class Map01(BaseMap):
 
         # CUTSCENE MODE.
         if self.cutscene:
-            self.refresh_rects = [self.portal_rect, self.black_edge1, self.black_edge2]
+            self.refresh_rects = [self.camera.apply(self.portal_rect), self.black_edge1, self.black_edge2]
 
             if self.event < 7:
                 # Print dialogue based on self.event.
@@ -74,7 +81,6 @@ class Map01(BaseMap):
             elif self.event >= 12:
                 # Once dialogue is completed, Masir approaches the portal.
                 self.Masir.walking = True
-                self.Masir.rect.x += 1
                 self.black_edges(screen)
             else:
                 self.black_edges(screen)
@@ -91,13 +97,13 @@ class Map01(BaseMap):
                     self.portal_blast_start = False
 
             # Once Masir is in contact with the portal, kill the sprite and end the cutscene.
-            if self.Masir.rect.centerx == self.portal_rect.centerx:
+            if self.Masir.rect.centerx >= self.portal_rect.centerx:
                 self.Masir.kill()
                 self.cutscene = False
                 self.Masir_dead = True
 
             # Pygame event loop activates ONLY during cutscenes.
-            for event in pg.event.get():
+            for event in game_input.events():
 
                 if event.type == pg.KEYDOWN:
                     if event.key == pg.K_ESCAPE:
@@ -112,14 +118,18 @@ class Map01(BaseMap):
                         self.cutscene = False
 
         else:
-            self.refresh_rects = [self.portal_rect]
+            self.refresh_rects = [self.camera.apply(self.portal_rect)]
 
-        # Portal frame change and frame index reset.
+        # Portal frame. The frame index is advanced in step().
         if self.portal_start is True:
-            screen.blit(self.portal_images[self.p_index], (1115, 660))
-            self.p_index += 1
-            if self.p_index == len(self.portal_images):
-                self.p_index = 0
+            screen.blit(self.portal_images[self.p_index], self.camera.apply(self.portal_rect))
+
+    def unload(self):
+        # Masir only appears in this map, so his frames and their flipped variants are released with it.
+        super().unload()
+        for frames in self.Masir.all_frames:
+            frame_variants.discard(frames)
+        self.Masir = None
 
     def update(self, fursa, sprites, screen):
         self.cutscene_event(fursa, screen)
@@ -2,37 +2,44 @@ import pygame as pg
 from TiledMap import TiledMap
 from enemies import Skeleton
 from base_map import BaseMap
+from game_input import game_input
+
+# Area of the map in view from the spawn location.
+SPAWN_VIEW = pg.Rect((0, 0), (1920, 1080))
 
 
 # Area 2
 class Map02(BaseMap):
-    def __init__(self, package, sprites, enemy_frames, fi):
+    def __init__(self, package, sprites, enemy_frames, fi, assets=None):
         super().__init__(package)
         self.fi = fi
 
-        # Map graphics and music.
-        self.fi.cd('Maps Map_02')
-        self.map = TiledMap(self.fi.path('Map_02.tmx'))
-        self.map.make_map()
+        # Map graphics and sounds.
+        # Loaded here unless they were already prefetched in the background with load_assets.
+        if assets is None:
+            assets = self.load_assets(self.asset_paths(fi))
+        # Tiles are converted and the chunks in view from the spawn location rendered on the main thread,
+        # as the display can not be used from the worker thread the assets may have been loaded on.
+        # Prefetched assets were prepared while the portal was open, only what is left of it is done here.
+        self.map = assets['map']
+        self.map.load_tiles()
+        self.map.prerender(SPAWN_VIEW)
         self.blockers = self.map.blockers
+        self.blocker_index = self.map.blocker_index
+        self.camera.set_bounds(self.map.width, self.map.height)
 
-        # Fursa spawn location.
-        self.spawnx = 100
-        self.spawny = 500
+        # Fursa spawn location. Pressing W at the left edge of the map returns to the previous map.
+        # The exit is kept clear of the spawn location so that arriving Fursa is not already standing in it.
+        self.spawn = (100, 500)
+        self.exit_rect = pg.Rect((0, 0), (80, self.map.height))
 
         # BATTLE MODE.
-        # Battle map, spawn locations, turn order, and states.
-        self.battle_map = TiledMap(self.fi.path('battle_scene.tmx'))
-        self.battle_map.make_map()
-        self.battle_spawn_pos = self.battle_map.battle_spawns
-
-        # Add the combat boxes to the battle map front surface. Greatly improves fps due to alpha pixels.
-        self.battle_map.front_surface.blit(self.status_box, (50, 750))
-        self.battle_map.front_surface.blit(self.combat_box, (720, 750))
-        self.battle_map.front_surface.blit(self.description_box, (1410, 750))
-
-        # Declare enemys.
-        skeleton_01 = Skeleton(enemy_frames, 900, 500, self.fi)
+        # Battle arena, built when the first battle starts.
+        self.battle_scene = assets['battle_scene']
+
+        # Declare enemys. Frames are kept for enemies spawned later.
+        self.enemy_frames = enemy_frames
+        skeleton_01 = Skeleton(enemy_frames, 900, 500, self.fi, assets['skeleton_swing'])
         sprites['enemy'].add(skeleton_01)
 
         # The script is labeled using self.event. Each dialogue references a list containing two strings.
@@ -52,6 +59,42 @@ class Map02(BaseMap):
                         #  11:["You may call me Masir, little one.", 'Masir']
                         }
 
+    @staticmethod
+    def asset_paths(fi):
+        # Resolved on the main thread as the file navigator is shared and not thread safe.
+        fi.cd('Maps Map_02')
+        paths = {'map': fi.path('Map_02.tmx'),
+                 'battle_scene': fi.path('battle_scene.tmx')}
+        fi.cd('Enemies Skeleton')
+        paths['skeleton_swing'] = fi.path('swing.wav')
+        return paths
+
+    @staticmethod
+    def load_assets(paths):
+
+        """ Loads the compiled map, decodes its tileset images and loads the enemy sounds.
+            Does not touch any shared game state or the display so it can be run on a worker thread
+            while the previous map is still being played. """
+
+        return {'map': TiledMap(paths['map'], convert=False),
+                'battle_scene': paths['battle_scene'],
+                'skeleton_swing': pg.mixer.Sound(paths['skeleton_swing'])}
+
+    @staticmethod
+    def prepare_assets(assets, chunks=2):
+
+        """ Converts the tiles of the prefetched map, then renders the chunks in view from the spawn location
+            a few at a time. Called on the main thread every frame while the portal to the map is open,
+            so that entering the map does not do it all in one frame. """
+
+        game_map = assets['map']
+        if game_map.read_images is not None:
+            game_map.load_tiles()
+        elif game_map.opaque_lookup is None and game_map.assemble:
+            game_map.opaque_tiles()
+        else:
+            game_map.prerender(SPAWN_VIEW, chunks)
+
     def cutscene_event(self, fursa, screen):
 
         """ Start cutscene events when certain criteria are met.
@@ -76,7 +119,7 @@ class Map02(BaseMap):
                 self.black_edges(screen)
 
             # Pygame event loop activates ONLY during cutscenes.
-            for event in pg.event.get():
+            for event in game_input.events():
 
                 if event.type == pg.KEYDOWN:
                     if event.key == pg.K_ESCAPE:
@@ -105,5 +148,7 @@ class Map02(BaseMap):
 
         if self.battle is False:
             self.cutscene_event(fursa, screen)
+        elif self.battle_over(sprites['enemy']):
+            self.battle_end(fursa, sprites)
         else:
             self.battle_event(fursa, sprites['enemy'], screen)
@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+from xml.etree import ElementTree
+import numpy as np
+
+
+# Compiles Tiled maps (.tmx and their .tsx tilesets) into a compact binary file the game loads without parsing XML.
+# A compiled map holds the tile GID grid of every visible tile layer as a NumPy array, in drawing order and marked
+# as back or front with its horizontal parallax factor, the tilesets needed to cut the tiles from their images,
+# and the blocker and spawn rects.
+# Tiles flipped or rotated in Tiled carry flags in the top bits of their GID. Every flagged GID is given a GID of its own
+# past the last tileset and listed with the tile and flags it stands for, so the grids only hold plain GIDs.
+# Maps are compiled on first use and again whenever the .tmx or one of its .tsx files changes, or ahead of time with
+#   python3 map_compiler.py Maps/Map_01/Map_01_1920x1080.tmx ...
+# File layout: MAGIC, header length, json header, then the grids as little endian uint32 in layer order.
+MAGIC = b'KMP1'
+VERSION = 3
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), '.cache', 'maps')
+# Flags Tiled stores in the top bits of a GID, in the order they are applied after shifting them down by FLAG_SHIFT.
+FLIPPED_DIAGONALLY = 0x1
+FLIPPED_VERTICALLY = 0x2
+FLIPPED_HORIZONTALLY = 0x4
+FLAG_SHIFT = 29
+# The bit below them rotates hexagonal tiles, which kismet does not use. It is cleared along with them.
+GID_MASK = 0x0FFFFFFF
+
+
+# A map as loaded from its compiled file.
+class CompiledMap:
+    def __init__(self, header, grids):
+        # Size in tiles and tile size in pixels.
+        self.width = header['width']
+        self.height = header['height']
+        self.tilewidth = header['tilewidth']
+        self.tileheight = header['tileheight']
+        # Tilesets with the path of their image relative to the map. Sorted by firstgid.
+        self.tilesets = header['tilesets']
+        # Visible tile layers in drawing order as (name, front, parallax, grid). grid[y, x] is the GID of a tile,
+        # 0 for none. parallax is how fast the layer scrolls with the camera, 1 for along with the map.
+        self.layers = [(layer['name'], layer['front'], layer['parallax'], grid)
+                       for layer, grid in zip(header['layers'], grids)]
+        # Rects as (x, y, width, height).
+        self.blockers = header['blockers']
+        self.spawns = header['spawns']
+        # Tileset files of the map relative to it.
+        self.tileset_files = header['tileset_files']
+        # GIDs given to flipped or rotated tiles as {gid: (tile GID, flags)}. flags combine the FLIPPED_ constants.
+        self.flipped = {gid: (base, flags) for gid, base, flags in header['flipped']}
+
+
+def make_key(path, tileset_files):
+    # Key used to validate a compiled map. Built from the contents of the map and its tileset files
+    # like the baked frame cache, so copies and checkouts stay valid.
+    directory = os.path.dirname(path)
+    sources = [path] + [os.path.join(directory, source) for source in tileset_files]
+    sha = hashlib.sha1()
+    sha.update(str(VERSION).encode())
+    for source in sources:
+        sha.update(os.path.basename(source).encode())
+        with open(source, 'rb') as file:
+            sha.update(hashlib.sha1(file.read()).hexdigest().encode())
+    return sha.hexdigest()
+
+
+def object_rects(group):
+    # Object positions are truncated to whole pixels. Point objects have no size.
+    return [[int(float(obj.get(name, 0))) for name in ('x', 'y', 'width', 'height')] for obj in group.iter('object')]
+
+
+def compile_map(path):
+
+    """ Parses the map at path. Returns the header and the GID grid of every visible tile layer.
+        The last visible tile layer is drawn in front of the sprites and all others behind them.
+        Layers scroll at the factor in Tiled's parallaxx attribute, 1 if it is not set.
+        Flipped and rotated tiles are given new GIDs past the last tileset, listed in the header's flipped.
+        The object group named Blockers holds collision rects and Spawn Locations the battle spawns.
+        Other object groups follow the old rule: the first one is blockers, the rest spawns. """
+
+    root = ElementTree.parse(path).getroot()
+    directory = os.path.dirname(path)
+    width = int(root.get('width'))
+    height = int(root.get('height'))
+
+    tilesets = []
+    tileset_files = []
+    for element in root.iter('tileset'):
+        firstgid = int(element.get('firstgid'))
+        base = directory
+        if 'source' in element.attrib:
+            tileset_files.append(element.get('source'))
+            tsx_path = os.path.join(directory, element.get('source'))
+            element = ElementTree.parse(tsx_path).getroot()
+            base = os.path.dirname(tsx_path)
+        image = element.find('image')
+        tilesets.append({'firstgid': firstgid,
+                         'image': os.path.relpath(os.path.join(base, image.get('source')), directory),
+                         'trans': image.get('trans'),
+                         'tilewidth': int(element.get('tilewidth')),
+                         'tileheight': int(element.get('tileheight')),
+                         'columns': int(element.get('columns')),
+                         'tilecount': int(element.get('tilecount')),
+                         'spacing': int(element.get('spacing', 0)),
+                         'margin': int(element.get('margin', 0))})
+    tilesets.sort(key=lambda tileset: tileset['firstgid'])
+    # Flipped GIDs as {Tiled GID with flags: new GID}.
+    flipped = {}
+    next_gid = max((tileset['firstgid'] + tileset['tilecount'] for tileset in tilesets), default=1)
+
+    layers = []
+    grids = []
+    blockers = []
+    spawns = []
+    first_group = True
+    for element in root:
+        if element.get('visible') == '0':
+            continue
+        if element.tag == 'layer':
+            data = element.find('data')
+            if data.get('encoding') != 'csv':
+                raise ValueError('%s: only csv encoded layers are supported' % path)
+            grid = np.array([int(gid) for gid in data.text.replace('\n', '').split(',')], dtype='<u4')
+            for gid in np.unique(grid[grid > GID_MASK]).tolist():
+                if gid not in flipped:
+                    flipped[gid] = next_gid
+                    next_gid += 1
+                grid[grid == gid] = flipped[gid]
+            layers.append({'name': element.get('name'), 'front': False,
+                           'parallax': float(element.get('parallaxx', 1))})
+            grids.append(grid.reshape(height, width))
+        elif element.tag == 'objectgroup':
+            name = element.get('name')
+            if name == 'Blockers' or (name != 'Spawn Locations' and first_group):
+                blockers.extend(object_rects(element))
+            else:
+                spawns.extend(object_rects(element))
+            first_group = False
+    if layers:
+        layers[-1]['front'] = True
+
+    header = {'width': width, 'height': height,
+              'tilewidth': int(root.get('tilewidth')), 'tileheight': int(root.get('tileheight')),
+              'tilesets': tilesets, 'tileset_files': list(dict.fromkeys(tileset_files)),
+              'layers': layers, 'blockers': blockers, 'spawns': spawns,
+              'flipped': [[new_gid, gid & GID_MASK, gid >> FLAG_SHIFT] for gid, new_gid in flipped.items()]}
+    header['key'] = make_key(path, header['tileset_files'])
+    return header, grids
+
+
+def compiled_path(path, directory=CACHE_DIRECTORY):
+    # Compiled maps are named after the map file and the folder it is in.
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return os.path.join(directory, '%s_%s.bin' % (folder, os.path.splitext(os.path.basename(path))[0]))
+
+
+def write(path, header, grids):
+    # Written to a temporary file first so that an interrupted write never leaves a half written file behind.
+    data = json.dumps(header).encode()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<I', len(data)))
+        file.write(data)
+        for grid in grids:
+            file.write(grid.tobytes())
+    os.replace(temp_path, path)
+
+
+def read(path, source):
+    # Returns the header and grids of the compiled map at path, or None if it is missing, damaged or
+    # out of date with source, the map it was compiled from.
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        if data[:4] != MAGIC:
+            return None
+        header_length = struct.unpack_from('<I', data, 4)[0]
+        header = json.loads(data[8:8 + header_length].decode())
+        if header['key'] != make_key(source, header['tileset_files']):
+            return None
+        offset = 8 + header_length
+        size = header['width'] * header['height']
+        grids = []
+        for i in range(len(header['layers'])):
+            grid = np.frombuffer(data, dtype='<u4', count=size, offset=offset + 4 * size * i)
+            grids.append(grid.reshape(header['height'], header['width']))
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    return header, grids
+
+
+def load(path, directory=CACHE_DIRECTORY):
+    # Returns the CompiledMap of the map at path, compiling it if its compiled file is missing or out of date.
+    target = compiled_path(path, directory)
+    compiled = read(target, path)
+    if compiled is None:
+        compiled = compile_map(path)
+        try:
+            write(target, *compiled)
+        except OSError:
+            # A read only install compiles the map on every load.
+            pass
+    return CompiledMap(*compiled)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile Tiled maps for faster loading.')
+    parser.add_argument('maps', nargs='+', metavar='TMX')
+    options = parser.parse_args()
+    for tmx in options.maps:
+        write(compiled_path(tmx), *compile_map(tmx))
+        print('%s -> %s' % (tmx, compiled_path(tmx)))
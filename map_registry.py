@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from asset_loader import worker_pool
+
+
+# Builds maps by name and keeps the ones built so far in a least recently used cache.
+# Maps that are left stay cached, so going back to an area resumes it where it was left instead of rebuilding it.
+# Once the cached maps take up more than max_bytes, the least recently used ones other than the current map
+# are unloaded, which releases their surfaces, sounds and sprites. An unloaded map is built again when it is entered.
+class MapRegistry:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # Name to (build, asset_paths, load_assets, prepare_assets) of every registered map.
+        self.entries = {}
+        self.maps = OrderedDict()
+        # Futures of assets loading in the background, by map name.
+        self.prefetched = {}
+        self.current = None
+
+    def register(self, name, build, asset_paths=None, load_assets=None, prepare_assets=None):
+
+        """ Registers a map. build(assets) constructs it.
+            Maps that can load their assets apart from being built also give asset_paths(), called on the main thread,
+            and load_assets(paths), run on the worker pool by prefetch. build is given None if nothing was prefetched.
+            prepare_assets(assets) does a slice of the work on loaded assets that has to be done on the main thread,
+            such as rendering a few chunks of the map, so that it is not all done in the frame the map is built. """
+
+        self.entries[name] = (build, asset_paths, load_assets, prepare_assets)
+
+    def prefetch(self, name):
+        # Starts loading the assets of a map in the background. Does nothing if it is built.
+        # Once they are loaded, every further call prepares a slice of them, so it is meant to be called every frame.
+        build, asset_paths, load_assets, prepare_assets = self.entries[name]
+        if load_assets is None or name in self.maps:
+            return
+        future = self.prefetched.get(name)
+        if future is None:
+            self.prefetched[name] = worker_pool().submit(load_assets, asset_paths())
+        elif prepare_assets is not None and future.done() and future.exception() is None:
+            prepare_assets(future.result())
+
+    def get(self, name):
+        # Returns the map called name, building it if it is not cached.
+        # Prefetched assets are swapped in, only blocking if they have not finished loading yet.
+        if name in self.maps:
+            self.maps.move_to_end(name)
+            return self.maps[name]
+        future = self.prefetched.pop(name, None)
+        game_map = self.entries[name][0](future.result() if future is not None else None)
+        self.maps[name] = game_map
+        return game_map
+
+    def switch(self, name, sprites):
+        # Leaves the current map, enters the map called name and returns it.
+        if self.current is not None:
+            self.maps[self.current].leave(sprites)
+        game_map = self.get(name)
+        game_map.enter(sprites)
+        self.current = name
+        self.evict()
+        return game_map
+
+    def memory(self):
+        # Bytes of pixels held by the cached maps. Tileset images shared by several maps are counted once.
+        sheets = {id(image): image for game_map in self.maps.values() for image in game_map.tileset_images()}
+        return (sum(game_map.memory() for game_map in self.maps.values()) +
+                sum(image.get_pitch() * image.get_height() for image in sheets.values()))
+
+    def evict(self):
+        # Unloads the least recently used maps until the cache fits in max_bytes. The current map is always kept.
+        size = self.memory()
+        for name in list(self.maps):
+            if size <= self.max_bytes:
+                break
+            if name != self.current:
+                self.unload(name)
+                size = self.memory()
+
+    def unload(self, name):
+        # Releases a cached map. It is built again the next time it is entered.
+        game_map = self.maps.pop(name, None)
+        if game_map is not None:
+            game_map.unload()
@@ -1,4 +1,8 @@
 import pygame as pg
+from frame_cache import FrameCache
+from asset_loader import load_images
+from physics import sweep
+from frame_variants import frame_variants
 
 
 class Masir_sprite(pg.sprite.Sprite):
@@ -43,15 +47,30 @@ class Masir_sprite(pg.sprite.Sprite):
 
         directories = ["NPCs Masir Idle_Png", "NPCs Masir Walk_Png", "NPCs Masir Action_Png"]
 
-        # Create a list containing lists with all animation frames. Each list is referenceable by the state ID shown above.
-        for i, directory in enumerate(directories):
+        # Source files of every animation, in the same order as the state IDs above.
+        sources = []
+        for directory in directories:
             self.fi.cd(directory)
-            for img_file in self.fi.file_list():
-                self.all_frames[i].append(pg.transform.scale(pg.image.load(self.fi.path(img_file)).convert_alpha(), (256, 256)))
+            sources.append([self.fi.path(img_file) for img_file in self.fi.file_list()])
+
+        def build():
+            # Images are decoded in parallel by the asset loader, then converted and scaled on the main thread.
+            return [[pg.transform.scale(image.convert_alpha(), (256, 256)) for image in load_images(paths)]
+                    for paths in sources]
+
+        # Create a list containing lists with all animation frames. Each list is referenceable by the state ID shown above.
+        # Frames are read from the baked frame cache and only decoded and scaled when a source image has changed.
+        frames = FrameCache(self.fi).load('masir', [path for paths in sources for path in paths], (256, 256), build)
+        for i, images in enumerate(frames):
+            self.all_frames[i].extend(images)
 
         # Create a list of number of frames for each animation. Used to know when frame_index should be reset.
         self.frame_maxes = [len(images) for images in self.all_frames]
 
+        # Build the left facing frames once so that turning around never flips frames in update.
+        for images in self.all_frames:
+            frame_variants.flipped(images)
+
     def change_state(self):
 
         """ Function that changes Masir's animation depending on cutscene output.
@@ -81,6 +100,10 @@ class Masir_sprite(pg.sprite.Sprite):
 
         self.change_state()
 
+        # Walks towards the portal during cutscenes.
+        if self.walking:
+            self.rect.x += 1 * dt
+
         if (time - self.frame_dt) >= self.frame_speed or self.facing_right != self.frame_override:
             self.frame_dt = time
 
@@ -91,7 +114,7 @@ class Masir_sprite(pg.sprite.Sprite):
                 self.frame_index += 1
                 self.frame_override = True
             else:
-                self.image = pg.transform.flip(self.current_frames[self.frame_index], True, False)
+                self.image = frame_variants.flipped(self.current_frames)[self.frame_index]
                 self.frame_index += 1
                 self.frame_override = False
 
@@ -100,13 +123,8 @@ class Masir_sprite(pg.sprite.Sprite):
                 self.frame_index = 0
 
         # Gravity emulation with current map blockers.
-        for block in map.blockers:
-            # Checks to see if Fursa is in contact with the ground.
-            if self.rect.colliderect(block):
-                self.on_ground = True
-                break
-            else:
-                self.on_ground = False
+        # Checks to see if Fursa is in contact with the ground. Only nearby blockers are tested.
+        self.on_ground = map.blocker_index.collides(self.rect)
 
         if self.on_ground is False:
             # If not in contact with the ground, accelerates falling down every 20 ms.
@@ -114,13 +132,10 @@ class Masir_sprite(pg.sprite.Sprite):
             if (time - self.gravity_dt) >= 20:
                 self.gravity_dt = time
                 self.fall_rate *= 1.1 # Acceleration rate.
-                for i in range(int(self.fall_rate)):
-                    self.rect.y += 1
-                    # Halts falling when Fursa lands on a block.
-                    for block in map.blockers:
-                        if self.rect.colliderect(block):
-                            self.fall_rate = 1
-                            self.on_ground = True
-                            break
-                    if self.on_ground is True:
-                        break
+                # The whole fall is resolved in one step against the blockers.
+                fall, landed = sweep(self.rect, int(self.fall_rate), map.blocker_index)
+                self.rect.y += fall
+                # Halts falling when Masir lands on a block.
+                if landed:
+                    self.fall_rate = 1
+                    self.on_ground = True
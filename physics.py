@@ -0,0 +1,38 @@
+import pygame as pg
+
+
+# Shared movement and collision resolution for sprites.
+
+
+def sweep(rect, dy, blocker_index):
+
+    """ Moves rect vertically by up to dy pixels against the blockers of a map in a single step.
+        Gives the same result as moving the rect one pixel at a time and stopping on the first pixel
+        it overlaps a blocker, which leaves the rect one pixel inside the blocker so that ground checks succeed.
+        Returns the distance actually moved, which places the rect at the exact contact point,
+        and whether a blocker was hit. rect itself is not moved. """
+
+    if dy == 0:
+        return 0, False
+    # Area covered by the rect over the whole move. Only blockers inside it can be hit.
+    if dy > 0:
+        swept = pg.Rect(rect.x, rect.y + 1, rect.width, rect.height + dy - 1)
+    else:
+        swept = pg.Rect(rect.x, rect.y + dy, rect.width, rect.height - dy - 1)
+
+    distance = dy
+    hit = False
+    for block in blocker_index.query(swept):
+        if dy > 0:
+            # First downward offset at which the rect overlaps the block.
+            d = max(1, block.top - rect.bottom + 1)
+            if rect.top + d < block.bottom and d <= distance:
+                distance = d
+                hit = True
+        else:
+            # First upward offset at which the rect overlaps the block.
+            d = min(-1, block.bottom - rect.top - 1)
+            if rect.bottom + d > block.top and d >= distance:
+                distance = d
+                hit = True
+    return distance, hit
@@ -0,0 +1,44 @@
+import pygame as pg
+
+
+# Uniform grid index of static rects such as map blockers.
+# Every rect is stored in each grid cell it overlaps, so a query only tests the rects in the
+# cells around the queried rect instead of every rect on the map.
+class SpatialHash:
+    def __init__(self, rects, cell_size=128):
+        self.cell_size = cell_size
+        self.rects = list(rects)
+        self.cells = {}
+        for i, rect in enumerate(self.rects):
+            for cell in self.cells_of(rect):
+                self.cells.setdefault(cell, []).append(i)
+
+    def cells_of(self, rect):
+        # Grid cells overlapped by a rect. Empty rects still occupy the cell of their top left corner.
+        size = self.cell_size
+        right = max(rect.right - 1, rect.left)
+        bottom = max(rect.bottom - 1, rect.top)
+        for cy in range(rect.top // size, bottom // size + 1):
+            for cx in range(rect.left // size, right // size + 1):
+                yield cx, cy
+
+    def candidates(self, rect):
+        # Indexes of the rects sharing a cell with rect, in the order they were added.
+        found = set()
+        for cell in self.cells_of(rect):
+            found.update(self.cells.get(cell, ()))
+        return sorted(found)
+
+    def query(self, rect):
+        # All indexed rects overlapping rect.
+        rect = pg.Rect(rect)
+        return [self.rects[i] for i in self.candidates(rect) if rect.colliderect(self.rects[i])]
+
+    def collides(self, rect):
+        # True if any indexed rect overlaps rect.
+        rect = pg.Rect(rect)
+        for cell in self.cells_of(rect):
+            for i in self.cells.get(cell, ()):
+                if rect.colliderect(self.rects[i]):
+                    return True
+        return False
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import pygame as pg
+
+
+# Characters rasterised as soon as an atlas is made. Anything else is added the first time it is drawn.
+PRELOAD = ''.join(chr(c) for c in range(32, 127))
+
+
+# Every glyph of one font at one size and colour, rasterised once into a single surface.
+# Strings are drawn with one batched blits call from the atlas instead of rendering a new surface.
+# The layout of each string is cached, so drawing text that was drawn before renders nothing.
+class GlyphAtlas:
+    def __init__(self, font, size, color, width=1024, max_layouts=256):
+        self.font = font
+        self.size = size
+        self.color = color
+        self.surface = pg.Surface((width, 64), pg.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+        # Character to (area in the atlas, glyph rect from font.render). None for glyphs with no pixels.
+        self.glyphs = {}
+        # Glyphs are packed left to right in shelves.
+        self.shelf_x = 0
+        self.shelf_y = 0
+        self.shelf_height = 0
+        # String to (text rect, [(area, offset)], number of glyphs shown for each number of characters).
+        self.layouts = OrderedDict()
+        self.max_layouts = max_layouts
+        for char in PRELOAD:
+            self.glyph(char)
+
+    def glyph(self, char):
+        if char in self.glyphs:
+            return self.glyphs[char]
+        surface, rect = self.font.render(char, self.color, size=self.size)
+        if char.isspace() or rect.width == 0:
+            self.glyphs[char] = None
+            return None
+
+        width, height = surface.get_size()
+        if self.shelf_x + width > self.surface.get_width():
+            self.shelf_x = 0
+            self.shelf_y += self.shelf_height + 1
+            self.shelf_height = 0
+        if self.shelf_y + height > self.surface.get_height():
+            # Grow the atlas. Areas of glyphs already packed stay valid.
+            grown = pg.Surface((self.surface.get_width(), max(self.surface.get_height() * 2, self.shelf_y + height)),
+                               pg.SRCALPHA)
+            grown.fill((0, 0, 0, 0))
+            grown.blit(self.surface, (0, 0))
+            self.surface = grown
+        area = pg.Rect((self.shelf_x, self.shelf_y), (width, height))
+        self.surface.blit(surface, area)
+        self.shelf_x += width + 1
+        self.shelf_height = max(self.shelf_height, height)
+        self.glyphs[char] = (area, rect)
+        return self.glyphs[char]
+
+    def layout(self, text):
+
+        """ Returns the cached layout of text. The text rect is the same as the one font.render returns,
+            and glyph offsets are relative to the top left of the surface font.render would return. """
+
+        layout = self.layouts.get(text)
+        if layout is not None:
+            self.layouts.move_to_end(text)
+            return layout
+
+        rect = self.font.get_rect(text, size=self.size)
+        items = []
+        counts = [0]
+        pen = 0
+        for char, metrics in zip(text, self.font.get_metrics(text, size=self.size)):
+            glyph = self.glyph(char)
+            if glyph is not None:
+                area, glyph_rect = glyph
+                items.append((area, (round(pen) + glyph_rect.x - rect.x, rect.y - glyph_rect.y)))
+            if metrics is not None:
+                pen += metrics[4]
+            counts.append(len(items))
+
+        layout = (rect, items, counts)
+        self.layouts[text] = layout
+        if len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+        return layout
+
+    def get_rect(self, text):
+        return self.layout(text)[0]
+
+    def blit_items(self, text, position, count=None):
+        # (atlas, position, area) for every glyph of text drawn at position, ready for Surface.blits.
+        # Only the first count characters are included if count is given.
+        rect, items, counts = self.layout(text)
+        if count is not None:
+            items = items[:counts[min(count, len(text))]]
+        x, y = position
+        return [(self.surface, (x + dx, y + dy), area) for area, (dx, dy) in items]
+
+    def draw(self, screen, text, position, count=None):
+        # Blits text with its top left at position. Returns the screen rect of the text.
+        screen.blits(self.blit_items(text, position, count), doreturn=False)
+        return pg.Rect(position, self.get_rect(text).size)
+
+
+# Atlases for every font, size and colour in use. Shared so each is only rasterised once.
+class TextEngine:
+    def __init__(self):
+        self.atlases = {}
+
+    def atlas(self, font, size=None, color=None):
+        # Size and colour default to the ones set on the font.
+        size = font.size if size is None else size
+        color = tuple(pg.Color(font.fgcolor if color is None else color))
+        key = (id(font), size, color)
+        entry = self.atlases.get(key)
+        # The font is kept with its atlas so its id can not be reused while it is cached.
+        if entry is None or entry[0] is not font:
+            entry = self.atlases[key] = (font, GlyphAtlas(font, size, color))
+        return entry[1]
+
+
+text_engine = TextEngine()
@@ -0,0 +1,52 @@
+import hashlib
+import io
+import threading
+import weakref
+import pygame as pg
+
+
+# Tileset images shared by every TiledMap.
+# Maps keep their own copies of the tileset files, so images are keyed by the hash of their contents instead of their
+# path and the same sheet is decoded and converted only once however many maps use it.
+# Images are held weakly: a sheet stays cached while a loaded map still cuts tiles from it and is released with the
+# last such map. Sheets can be read and decoded on worker threads with read(), but they are only converted on the
+# main thread by image(). Lookups are locked as both threads use the cache.
+class TilesetCache:
+    def __init__(self):
+        self.images = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def read(self, path, trans=None):
+        # Reads the tileset image in path. trans is the hex colour used as its colorkey, if any.
+        # Returns its key and the decoded image, which is None if the image is already cached. Nothing is converted.
+        with open(path, 'rb') as file:
+            data = file.read()
+        key = (hashlib.sha1(data).hexdigest(), trans)
+        with self.lock:
+            if key in self.images:
+                return key, None
+        # Decoded from the bytes already read for the hash.
+        return key, pg.image.load(io.BytesIO(data), path)
+
+    def image(self, path, trans=None, read=None):
+        # Returns the converted tileset image in path. read is what read() returned for it if it was called already.
+        # Must be called on the main thread.
+        key, decoded = read if read is not None else self.read(path, trans)
+        with self.lock:
+            image = self.images.get(key)
+        if image is not None:
+            return image
+        if decoded is None:
+            # Released since it was read.
+            key, decoded = self.read(path, trans)
+        if trans is not None:
+            decoded.set_colorkey(pg.Color('#' + trans.lstrip('#')))
+            image = decoded.convert()
+        else:
+            image = decoded.convert_alpha()
+        with self.lock:
+            self.images[key] = image
+        return image
+
+
+tileset_cache = TilesetCache()
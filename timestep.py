@@ -0,0 +1,75 @@
+import pygame as pg
+
+
+# Fixed rate simulation clock.
+# Real frame time is collected in an accumulator and spent in fixed size steps, so sprites and maps
+# behave the same no matter how fast frames are rendered. Rendering interpolates sprite positions
+# between the last two steps using alpha.
+class FixedTimestep:
+    def __init__(self, step_ms=11, max_steps=5, realtime=True):
+        # One step is one dt unit of sprite movement. 11 ms matches the old dt = round(ms / 11).
+        self.step_ms = step_ms
+        # Most steps simulated for a single rendered frame. Time beyond it is dropped so a long
+        # stall does not snowball into ever longer frames.
+        self.max_steps = max_steps
+        self.accumulator = 0
+        # Simulated time in ms. Used in place of pg.time.get_ticks() by every timer in the simulation.
+        self.time = 0
+        # False when fast forwarding. Waits are then skipped instead of slept.
+        self.realtime = realtime
+        self.waited = 0
+
+    def advance(self, frame_ms):
+        # Adds the real time of a frame. Returns the number of steps to simulate before rendering.
+        self.accumulator += frame_ms
+        steps = int(self.accumulator // self.step_ms)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = self.step_ms * self.max_steps
+        self.accumulator -= steps * self.step_ms
+        return steps
+
+    def wait(self, ms):
+        # Pauses the game for ms, such as the battle intro. The simulation is stopped during a pause, so it is the
+        # same whether it is slept in real time or skipped when fast forwarding.
+        # Slept time shows up in the next frame time and has to be taken out of it with take_waited().
+        if self.realtime and ms > 0:
+            pg.time.wait(ms)
+            self.waited += ms
+
+    def take_waited(self):
+        # Time slept since the last call.
+        waited = self.waited
+        self.waited = 0
+        return waited
+
+    def step(self):
+        # Moves simulated time forward by one step and returns it.
+        self.time += self.step_ms
+        return self.time
+
+    @property
+    def alpha(self):
+        # Fraction of a step that has passed since the last simulated step.
+        return self.accumulator / self.step_ms
+
+
+def store_positions(groups):
+    # Remember where every sprite was before a step so rendering can interpolate from there.
+    for group in groups:
+        for sprite in group.sprites():
+            sprite.prev_pos = sprite.rect.topleft
+
+
+def interpolate(sprite, alpha, max_distance=64):
+    # Position to draw a sprite at between its last two steps.
+    # Sprites that jumped further than max_distance in a step (teleports, spawns) are not interpolated.
+    prev_pos = getattr(sprite, 'prev_pos', None)
+    rect = sprite.rect
+    if prev_pos is None or alpha >= 1:
+        return rect
+    dx = rect.x - prev_pos[0]
+    dy = rect.y - prev_pos[1]
+    if abs(dx) > max_distance or abs(dy) > max_distance:
+        return rect
+    return rect.move(round(dx * alpha) - dx, round(dy * alpha) - dy)
@@ -0,0 +1,113 @@
+import heapq
+from itertools import count
+
+
+# Decides whose turn it is in a battle of any size.
+# Combatants wait in a heap keyed by when they act next, so taking a turn, joining, leaving and changing speed
+# are all O(log n). Entries that are replaced or removed are only marked stale and skipped once they reach the top.
+#   Turn mode (default): battles go in rounds where everyone acts once, fastest first. Ties go in the order
+#                        combatants were queued. A speed change moves a combatant still waiting for its turn
+#                        right away, also within the current round, and it goes after others of its new speed.
+#   ATB mode:            every combatant has a gauge that fills at its speed and acts when it is full, so fast
+#                        combatants get more turns. A speed change keeps the gauge filled so far.
+class TurnScheduler:
+    def __init__(self, combatants=(), atb=False, gauge=100):
+        self.atb = atb
+        self.gauge = gauge
+        self.heap = []
+        # Combatant to its live heap entry [key, tie, combatant, valid].
+        self.entries = {}
+        # ATB gauge start time of each queued combatant.
+        self.started = {}
+        self.tie = count()
+        self.round = 0
+        # ATB time. Moves forward to the moment each gauge fills.
+        self.time = 0
+        self.current = None
+        for combatant in combatants:
+            self.add(combatant)
+
+    def __len__(self):
+        # The current combatant is out of the heap until its turn ends.
+        return len(self.entries) + (self.current is not None)
+
+    def __contains__(self, combatant):
+        return combatant in self.entries or combatant is self.current
+
+    def push(self, combatant, key):
+        entry = [key, next(self.tie), combatant, True]
+        self.entries[combatant] = entry
+        heapq.heappush(self.heap, entry)
+
+    def invalidate(self, combatant):
+        entry = self.entries.pop(combatant, None)
+        if entry is not None:
+            entry[3] = False
+            # Rebuild once stale entries outnumber live ones so the heap does not grow without bound.
+            if len(self.heap) > 2 * len(self.entries) + 16:
+                self.heap = [entry for entry in self.heap if entry[3]]
+                heapq.heapify(self.heap)
+
+    def queue(self, combatant, next_round):
+        # Queues combatant for its next turn: in turn mode in the given round, in ATB mode with an empty gauge.
+        if self.atb:
+            self.started[combatant] = self.time
+            self.push(combatant, self.time + self.gauge / combatant.speed)
+        else:
+            self.push(combatant, (next_round, -combatant.speed))
+
+    def add(self, combatant):
+        # Joins the battle. Acts this round if it has not started yet, otherwise from the next one.
+        if combatant not in self:
+            self.queue(combatant, self.round + (self.current is not None))
+
+    def remove(self, combatant):
+        # Leaves the battle, such as when knocked out.
+        self.invalidate(combatant)
+        self.started.pop(combatant, None)
+        if combatant is self.current:
+            self.current = None
+
+    def set_speed(self, combatant, speed):
+        # Changes the speed of combatant, which must be above 0, and moves it in the queue.
+        old_speed = combatant.speed
+        combatant.speed = speed
+        entry = self.entries.get(combatant)
+        if entry is None:
+            return
+        self.invalidate(combatant)
+        if self.atb:
+            # Keep the part of the gauge already filled.
+            filled = (self.time - self.started[combatant]) * old_speed
+            self.started[combatant] = self.time - filled / speed
+            self.push(combatant, self.time + (self.gauge - filled) / speed)
+        else:
+            self.push(combatant, (entry[0][0], -speed))
+
+    def gauge_fill(self, combatant):
+        # Fraction of combatant's ATB gauge that is filled.
+        if not self.atb or combatant not in self.started:
+            return 1.0 if combatant is self.current else 0.0
+        return min((self.time - self.started[combatant]) * combatant.speed / self.gauge, 1.0)
+
+    def next(self):
+
+        """ Ends the turn of the current combatant, queues it for its next turn and returns whose turn it is now.
+            Returns None when no one is left. """
+
+        if self.current is not None:
+            self.queue(self.current, self.round + 1)
+        while self.heap:
+            key, tie, combatant, valid = heapq.heappop(self.heap)
+            if not valid:
+                continue
+            del self.entries[combatant]
+            if self.atb:
+                self.time = key
+                self.started.pop(combatant, None)
+            else:
+                self.round = key[0]
+            self.current = combatant
+            return combatant
+        self.current = None
+        return None